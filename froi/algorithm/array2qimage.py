@@ -4,6 +4,7 @@
 """Some basic functions for image construction."""
 
 import sys as _sys
+import weakref as _weakref
 import numpy as _np
 from PyQt4 import QtGui as _qt
 from matplotlib import cm as mpl_cm
@@ -207,6 +208,96 @@ def alpha_view(qimage):
     return bytes[..., _bgra[3]]
 
 
+_pysurfer_cmaps = ['rocket', 'mako', 'icefire', 'vlag']
+_pysurfer_cmaps.extend([cmap+'_r' for cmap in _pysurfer_cmaps])
+
+# cache of uint8 color LUTs with shape (256, 4), keyed by colormap name
+_lut_cache = {}
+
+
+def get_lut(colormap):
+    """Return the uint8 color LUT with shape (256, 4) of a named colormap.
+
+    The LUT is built only once for each colormap name, and then it is
+    fetched from the module level cache.
+    """
+    lut = _lut_cache.get(colormap)
+    if lut is None:
+        if colormap in _pysurfer_cmaps:
+            cmap = getattr(surfer_cm, colormap)
+        else:
+            try:
+                # Try to get a named matplotlib colormap
+                cmap = mpl_cm.get_cmap(colormap)
+            except (TypeError, ValueError):
+                raise ValueError("There is no colormap about '{}'.".format(colormap))
+        # Convert from a matplotlib colormap to a lut array
+        lut = (cmap(_np.linspace(0, 1, 256)) * 255).astype(_np.uint8)
+        _lut_cache[colormap] = lut
+    return lut
+
+
+def lut_mapping(array, lut):
+    """Map a normalized 1D or 2D array into a rgba array through the LUT.
+
+    The array's values are truncated to integers and used as the row indices
+    of the LUT. Indices out of the LUT's range are clipped to its bounds.
+    """
+    index = _np.asarray(array).astype(_np.intp)
+    return lut.take(index, axis=0, mode='clip')
+
+
+class LabelLUT(object):
+    """Lookup table which maps label values to rgb colors in one pass.
+
+    The labels are stored in a dense index->rgba table when all of them are
+    non-negative and not larger than `dense_limit`. Otherwise, the labels are
+    kept sorted and looked up by binary search.
+    The forth column of the table is 1 for visible (i.e. non-black) colors
+    and 0 for others, values which are not labels are mapped to zeros.
+    """
+    dense_limit = 65535
+
+    def __init__(self, colormap):
+        """
+        Parameters
+        ----------
+        colormap : dict
+            key is a label value, value is its color [r, g, b].
+        """
+        keys = sorted([int(item) for item in colormap.keys()])
+        rgba = _np.zeros((len(keys), 4), dtype=_np.uint8)
+        for i, item in enumerate(keys):
+            rgba[i, :3] = colormap[item][:3]
+        rgba[:, 3] = _np.any(rgba[:, :3], 1)
+
+        self._keys = _np.array(keys, dtype=_np.int64)
+        if keys and (keys[0] < 0 or keys[-1] > self.dense_limit):
+            self._table = rgba
+            self._dense = False
+        else:
+            n_rows = keys[-1] + 2 if keys else 1
+            # the last row is left to be zeros for values which are not labels
+            self._table = _np.zeros((n_rows, 4), dtype=_np.uint8)
+            self._table[self._keys] = rgba
+            self._dense = True
+
+    def take(self, array):
+        """Return the rgba array of the label array."""
+        array = _np.asarray(array)
+        if self._dense:
+            index = array.astype(_np.intp)
+            invalid = _np.logical_or(index != array, index < 0)
+            index[invalid] = len(self._table) - 1
+            return self._table.take(index, axis=0, mode='clip')
+        else:
+            pos = _np.searchsorted(self._keys, array)
+            pos = pos.clip(0, len(self._keys) - 1)
+            rgba = self._table.take(pos, axis=0)
+            rgba[self._keys[pos] != array] = 0
+            return rgba
+
+
 def array2qrgba(array, alpha, colormap, normalize=False, roi=None):
     """Convert a 2D-array into a 3D-array containing rgba value."""
     if _np.ndim(array) not in [1, 2]:
@@ -216,8 +307,6 @@ def array2qrgba(array, alpha, colormap, normalize=False, roi=None):
         if colormap != 'rainbow':
             if colormap != 'single ROI':
                 array = _normalize255(array, normalize)
-                pysurfer_cmaps = ['rocket', 'mako', 'icefire', 'vlag']
-                pysurfer_cmaps.extend([cmap+'_r' for cmap in pysurfer_cmaps])
                 if colormap == 'gray':
                     new_array = gray(array, alpha)
                 elif colormap == 'red2yellow':
@@ -231,29 +320,7 @@ def array2qrgba(array, alpha, colormap, normalize=False, roi=None):
                 elif colormap == 'blue':
                     new_array = blue(array, alpha)
                 else:
-                    if colormap in pysurfer_cmaps:
-                        cmap = getattr(surfer_cm, colormap)
-                    else:
-                        try:
-                            # Try to get a named matplotlib colormap
-                            cmap = mpl_cm.get_cmap(colormap)
-                        except (TypeError, ValueError):
-                            raise ValueError("There is no colormap about '{}'.".format(colormap))
-                    # Convert from a matplotlib colormap to a lut array
-                    # lut_255 = (cmap(_np.linspace(0, 1, 256)) * 255).astype(_np.int)
-                    lut_255 = (cmap(_np.linspace(0, 1, 256)) * 255)
-                    # # Is it necessary to generate a color LUT with so many colors as the number of vertices?
-                    # lut_255 = (cmap(_np.linspace(0, 1, vtx_num)) * 255)
-
-                    new_array_shape = array.shape + (4,)
-                    new_array = _np.zeros(new_array_shape, dtype=_np.uint8)
-                    if array.ndim == 1:
-                        for i in range(array.shape[0]):
-                            new_array[i, :] = lut_255[int(array[i])]
-                    else:
-                        for i in range(array.shape[0]):
-                            for j in range(array.shape[1]):
-                                new_array[i, j, :] = lut_255[int(array[i, j])]
+                    new_array = lut_mapping(array, get_lut(colormap))
                     new_array[..., 3] = alpha * array.clip(0, 1)
 
             else:
@@ -302,22 +369,29 @@ def array2qrgba(array, alpha, colormap, normalize=False, roi=None):
             new_array[array > normalize[1]] = 0
         else:
             new_array[array < 0] = 0
-        values = colormap.keys()
-        values = [int(item) for item in values]
-        new_array2_shape = new_array.shape + (4,)
-        new_array2 = _np.zeros(new_array2_shape, dtype=_np.uint8)
-        for item in values:
-            new_array2[new_array == item] = [colormap[item][0],
-                                             colormap[item][1],
-                                             colormap[item][2],
-                                             0]
-        # if r+g+b+alpha >= 1, assign alpha to the forth channel
-        new_array2[..., 3] = alpha * _np.sum(new_array2, new_array2.ndim-1).clip(0, 1)
+        if not isinstance(colormap, LabelLUT):
+            colormap = LabelLUT(colormap)
+        new_array2 = colormap.take(new_array)
+        # if r+g+b >= 1, assign alpha to the forth channel
+        new_array2[..., 3] = alpha * new_array2[..., 3]
         new_array = new_array2
 
     return new_array
 
 
+def _blend_into(acc, source):
+    """Blend the rgba source over the uint16 rgb accumulator acc in place.
+
+    The acc must hold values in 0..255, so that the intermediate
+    acc * (255 - alpha) + source * alpha never exceeds 65025.
+    """
+    alpha = source[..., 3:].astype(_np.uint16)
+    acc *= 255 - alpha
+    acc += source[..., :3] * alpha
+    acc //= 255
+    return acc
+
+
 def qcomposition(array_list):
     """Composite several qrgba arrays into one."""
     if not len(array_list):
@@ -327,27 +401,24 @@ def qcomposition(array_list):
     if dimension not in (2, 3):
         raise ValueError('RGBA array must be 2D or 3D.')
 
-    result = _np.array(array_list[0][..., :3], dtype=_np.int64)
-    if dimension == 3:
-        h, w, channel = array_list[0].shape
-        for index in range(1, len(array_list)):
-            item = _np.array(array_list[index], dtype=_np.int64)
-            alpha_array = _np.tile(item[..., -1].reshape((-1, 1)), (1, 1, 3))
-            alpha_array = alpha_array.reshape((h, w, 3))
-            result = item[..., :3] * alpha_array + result * (255 - alpha_array)
-            result /= 255
-    elif dimension == 2:
-        for i in range(1, len(array_list)):
-            item = array_list[i].astype(_np.int64)
-            alpha_channel = item[:, -1]
-            alpha_channels = _np.tile(alpha_channel, (3, 1)).T
-            result = item[:, :3] * alpha_channels + result * (255 - alpha_channels)
-            result /= 255
+    result = _np.array(array_list[0][..., :3], dtype=_np.uint16)
+    for item in array_list[1:]:
+        _blend_into(result, item)
     result = result.astype(_np.uint8)
 
     return result
 
 
+def blend_rgba(dest, source):
+    """Return the blend of the rgba source over the rgb dest.
+
+    The blending is computed with integer arithmetic in uint16, i.e.
+    (source * alpha + dest * (255 - alpha)) / 255.
+    """
+    result = _blend_into(dest.astype(_np.uint16), source)
+    return result.astype(_np.uint8)
+
+
 def composition(dest, source):
     """Save result in place
     
@@ -355,25 +426,99 @@ def composition(dest, source):
     ----
     The dest is a rgb image, while the source is a rgba image
     """
-    alpha = source[...,3].reshape(source.shape[0], source.shape[1], 1).astype(_np.float)
-    alpha /= 255
-    source_rgb = source[...,:3].astype(_np.float)
-    dest[:] = _np.uint8(source_rgb * alpha + dest.astype(_np.float) * (1 - alpha))
+    dest[:] = blend_rgba(dest, source)
     return dest
 
 
-def qrgba2qimage(array):
-    """Convert the input array into a image."""
+def qrgba2qimage(array, image=None):
+    """Convert the input array into a image.
+
+    If a ARGB32 image with the same size is given, its buffer is reused.
+    """
     if _np.ndim(array) != 3:
         raise ValueError("RGBA array must be 3D.")
 
     h, w, channel = array.shape
     fmt = _qt.QImage.Format_ARGB32
-    result = _qt.QImage(w, h, fmt)
-    rgb_view(result)[:] = array[..., :3]
-    alpha = alpha_view(result)
+    if image is None or image.format() != fmt or \
+            (image.height(), image.width()) != (h, w):
+        image = _qt.QImage(w, h, fmt)
+    rgb_view(image)[:] = array[..., :3]
+    alpha = alpha_view(image)
     alpha[:] = 255
-    return result
+    return image
+
+
+class SliceCompositor(object):
+    """Composite a stack of rgba layers over a rgb background incrementally.
+
+    Besides the result, only the blend of the background with the layers
+    below the last changed layer is kept, so repainting that layer (e.g.
+    drawing on a label) recomposites it and the layers above it only, and
+    the memory is fixed at three slice buffers whatever the number of
+    layers. The output QImage buffer is reused.
+    Layers are compared by identity through weak references, as a rendered
+    rgba array is replaced rather than modified when its data change, and
+    the compositor doesn't keep layers alive.
+    """
+
+    def __init__(self):
+        self._layers = []
+        self._background = None
+        # the blend of the background and the first _n_prefix layers
+        self._prefix = None
+        self._n_prefix = 0
+        self._blend = None
+        self._image = None
+
+    def clear(self):
+        """Drop the cached blends."""
+        self._layers = []
+        self._background = None
+        self._prefix = None
+        self._n_prefix = 0
+        self._blend = None
+
+    def composite(self, layers, background):
+        """Return the rgb blend of the layers (bottom first) over background.
+
+        The returned array is cached, so don't modify it.
+        """
+        if self._background is None or not (background is self._background or
+                _np.array_equal(background, self._background)):
+            self.clear()
+            self._background = background.copy()
+
+        start = 0
+        n = min(len(layers), len(self._layers))
+        while start < n and layers[start] is self._layers[start]():
+            start += 1
+        if self._blend is not None and start == len(layers) == len(self._layers):
+            return self._blend
+
+        self._layers = [_weakref.ref(layer) for layer in layers]
+        if start < self._n_prefix or self._prefix is None:
+            self._prefix = self._background
+            self._n_prefix = 0
+        for layer in layers[self._n_prefix:start]:
+            self._prefix = blend_rgba(self._prefix, layer)
+        self._n_prefix = start
+        blend = self._prefix
+        for layer in layers[start:]:
+            blend = blend_rgba(blend, layer)
+        self._blend = blend
+        return self._blend
+
+    def composite_image(self, layers, background):
+        """Return the blend of the layers over background as a QImage.
+
+        The QImage is updated only when the blend is changed.
+        """
+        old_blend = self._blend
+        blend = self.composite(layers, background)
+        if self._image is None or blend is not old_blend:
+            self._image = qrgba2qimage(blend, self._image)
+        return self._image
 
 
 def null_image(h, w):
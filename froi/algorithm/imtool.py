@@ -4,7 +4,7 @@
 import numpy as np
 from scipy import ndimage as nd
 from skimage import feature as skft
-from scipy.spatial import distance
+from scipy.spatial import cKDTree
 from nibabel.affines import apply_affine
 
 
@@ -62,40 +62,96 @@ def roi_filtering(src, ref):
     return result
 
 
+_roi_kernels = {}
+
+
+def roi_kernel(radius, shape='sphere'):
+    """
+    Return the offset mask of a regular ROI.
+
+    Parameters
+    ----------
+    radius : sequence
+        the radius (in voxels) along each axis
+    shape : str
+        'sphere' (an ellipsoid) or 'cube'
+
+    Return
+    ------
+    kernel : numpy bool array
+        the array of shape (2*radius+1), True where the ROI covers.
+        The kernels are cached and shouldn't be modified.
+    """
+    radius = tuple(int(r) for r in radius)
+    key = (shape, radius)
+    kernel = _roi_kernels.get(key)
+    if kernel is None:
+        if shape == 'sphere':
+            grids = np.ogrid[tuple(slice(-r, r + 1) for r in radius)]
+            # an axis whose radius is zero doesn't constrain the ellipsoid
+            dist = sum(np.square(g) / float(r ** 2) for g, r in zip(grids, radius) if r)
+            kernel = np.zeros([2 * r + 1 for r in radius], dtype=np.bool)
+            kernel[...] = np.asarray(dist) <= 1
+        elif shape == 'cube':
+            kernel = np.ones([2 * r + 1 for r in radius], dtype=np.bool)
+        else:
+            raise ValueError, 'Unknown ROI shape: %s' % shape
+        _roi_kernels[key] = kernel
+    return kernel
+
+
+def stamp_rois(data, coords, radii, values, shape='sphere'):
+    """
+    Draw regular ROIs centered in the coordinates into the data.
+
+    ROIs are drawn in turn, so a later ROI overwrites the overlapped
+    voxels of the former ones. The parts out of the data are clipped.
+
+    Parameters
+    ----------
+    data : numpy array
+        the 3D array to draw in, modified in place
+    coords : sequence
+        Nx3, the ROIs' centers in voxel coordinates
+    radii : sequence
+        Nx3 (or 3 for all ROIs), the ROIs' radii in voxels
+    values : sequence | scalar
+        the value of each ROI
+    shape : str
+        'sphere' or 'cube'
+
+    Return
+    ------
+    data : numpy array
+    """
+    coords = np.asarray(coords, dtype=np.int).reshape((-1, 3))
+    n_roi = coords.shape[0]
+    radii = np.zeros((n_roi, 3), dtype=np.int) + np.asarray(radii, dtype=np.int)
+    values = np.zeros(n_roi, dtype=np.asarray(values).dtype) + values
+    dims = np.array(data.shape[:3])
+
+    for coord, radius, value in zip(coords, radii, values):
+        kernel = roi_kernel(radius, shape)
+        start = coord - radius
+        stop = coord + radius + 1
+        lo = np.maximum(start, 0)
+        hi = np.minimum(stop, dims)
+        if np.any(lo >= hi):
+            continue
+        data_slice = tuple(slice(l, h) for l, h in zip(lo, hi))
+        kernel_slice = tuple(slice(l, h) for l, h in zip(lo - start, hi - start))
+        data[data_slice][kernel[kernel_slice]] = value
+    return data
+
+
 def sphere_roi(data, x, y, z, radius, value):
     """Generate a sphere roi which center in (x, y, z)."""
-    for n_x in range(x - radius[0], x + radius[0] + 1):
-        for n_y in range(y - radius[1], y + radius[1] + 1):
-            for n_z in range(z - radius[2], z + radius[2] + 1):
-                #if n_x < 0:
-                #    n_x = data.shape[0] - n_x
-                #if n_y < 0:
-                #    n_y = data.shape[1] - n_y
-                #if n_z < 0:
-                #    n_z = data.shape[2] - n_z
-                n_coord = np.array((n_x, n_y, n_z))
-                coord = np.array((x, y, z))
-                minus = coord - n_coord
-                if (np.square(minus) / np.square(np.array(radius)).astype(np.float)).sum() <= 1:
-                    try:
-                        data[n_x, n_y, n_z] = value
-                    except IndexError:
-                        pass
-    return data
+    return stamp_rois(data, [(x, y, z)], radius, value, 'sphere')
 
 
 def cube_roi(data, x, y, z, radius, value):
     """Generate a cube roi which center in (x, y, z)."""
-    for n_x in range(x - radius[0], x + radius[0] + 1):
-        for n_y in range(y - radius[1], y + radius[1] + 1):
-            for n_z in range(z - radius[2], z + radius[2] + 1):
-                try:
-                    data[n_x, n_y, n_z] = value
-                except IndexError:
-                    pass
-                # if n_x >= 0 and n_y >= 0 and n_z >= 0:
-                #    data[n_x, n_y, n_z] = value
-    return data
+    return stamp_rois(data, [(x, y, z)], radius, value, 'cube')
 
 
 def nonzero_coord(data):
@@ -151,7 +207,6 @@ def intersect(source, mask):
     # binary mask data
     mask[mask > 0] = 1
     temp = source * mask
-    temp = np.rot90(temp, 3)
     return temp
 
 
@@ -199,8 +254,7 @@ def nearest_labeling(src, tar):
     tarn = tar.nonzero()
     srcn_coord = np.column_stack((srcn[0], srcn[1], srcn[2]))
     tarn_coord = np.column_stack((tarn[0], tarn[1], tarn[2]))
-    dist = distance.cdist(srcn_coord, tarn_coord)
-    min_pos = np.argmin(dist, 0)
+    min_pos = cKDTree(srcn_coord).query(tarn_coord)[1]
     tar[tarn] = src[srcn][min_pos]
     return tar
 
@@ -220,21 +274,98 @@ def region_grow(seed, source, labeling=False):
 
 def extract_mean_ts(source, mask):
     """Extract mean time course in a mask from source image."""
-    mask[mask > 0] = 1
-    mask[mask < 0] = 0
-    src_dim = len(source.shape)
-    if src_dim > 3:
-        source_len = source.shape[3]
-        data = np.zeros((source_len, 1))
-        for idx in range(source_len):
-            temp = source[..., idx]
-            temp = temp * mask
-            data[idx] = temp.sum() / mask.sum()
+    _, data = extract_roi_ts(source, mask > 0, [True])
+    if source.ndim > 3:
+        return data.T
+    return data[0]
+
+
+def extract_roi_ts(source, label_data, labels=None, method='mean'):
+    """
+    Extract the time courses of all labels from the source image at once.
+
+    The source is read volume by volume, so a memory-mapped series is never
+    loaded entirely. The median and PCA methods keep the labeled voxels'
+    time courses only.
+
+    Parameters
+    ----------
+    source : numpy array
+        XxYxZ or XxYxZxT image
+    label_data : numpy array
+        XxYxZ label image
+    labels : sequence | None
+        the labels to be extracted. If None, use all nonzero labels.
+    method : str
+        'mean', 'median' or 'pca' (the first principal component, whose
+        sign is chosen to correlate positively with the mean time course)
+
+    Returns
+    -------
+    labels : numpy array
+        the extracted labels, sorted ascendingly
+    ts : numpy array
+        (n_labels, T) array, the time course of each label.
+        Labels without voxels get NaNs.
+    """
+    if method not in ('mean', 'median', 'pca'):
+        raise ValueError, 'Unknown method: %s' % method
+    if labels is None:
+        labels = np.unique(label_data[label_data != 0])
     else:
-        source = source * mask
-        data = source.sum() / mask.sum()
-        data = np.array([data])
-    return data
+        labels = np.unique(labels)
+    n_label = labels.shape[0]
+    mask = np.in1d(label_data.ravel(), labels).reshape(label_data.shape)
+    coords = np.nonzero(mask)
+    inverse = np.searchsorted(labels, label_data[coords])
+    size = np.bincount(inverse, minlength=n_label)
+
+    if source.ndim > 3:
+        n_time = source.shape[3]
+        get_volume = lambda t: source[..., t]
+    else:
+        n_time = 1
+        get_volume = lambda t: source
+
+    if method == 'mean':
+        ts = np.zeros((n_label, n_time))
+        for t in range(n_time):
+            ts[:, t] = np.bincount(inverse, np.asarray(get_volume(t))[coords], n_label)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ts /= size[:, None]
+        return labels, ts
+
+    # gather the voxels' time courses grouped by labels
+    order = np.argsort(inverse, kind='mergesort')
+    coords = tuple(c[order] for c in coords)
+    values = np.zeros((order.shape[0], n_time))
+    for t in range(n_time):
+        values[:, t] = np.asarray(get_volume(t))[coords]
+
+    ts = np.zeros((n_label, n_time)) + np.nan
+    for idx, voxel_ts in enumerate(np.split(values, np.cumsum(size)[:-1])):
+        if not voxel_ts.shape[0]:
+            continue
+        if method == 'median':
+            ts[idx] = np.median(voxel_ts, 0)
+        else:
+            mean_ts = np.mean(voxel_ts, 0)
+            centered = (voxel_ts - np.mean(voxel_ts, 1)[:, None]).T
+            u, s, _ = np.linalg.svd(centered, full_matrices=False)
+            component = u[:, 0] * s[0] / np.sqrt(voxel_ts.shape[0])
+            if np.dot(component, mean_ts - np.mean(mean_ts)) < 0:
+                component = -component
+            ts[idx] = component
+    return labels, ts
+
+
+def roi_correlation(ts):
+    """Return the ROI-by-ROI correlation matrix of the (n_rois, T) time courses.
+
+    The result is 2-D even for a single ROI. At least two time points are
+    needed, otherwise the correlations are NaNs.
+    """
+    return np.atleast_2d(np.corrcoef(ts))
 
 
 def voxel_number(source_data, voxel_value):
@@ -251,26 +382,35 @@ def voxel_number(source_data, voxel_value):
 
 
 def cluster_stats(source_data, cluster_data, image_affine):
-    """Get the cluster size, and the peak value, coordinate based on the#source_data."""
+    """Get the cluster size, and the peak value, coordinate based on the#source_data.
+
+    Each row of the returned array is [index, peak value, peak X, peak Y,
+    peak Z, size, mean value, center of mass X, Y, Z], and the rows are
+    sorted by the cluster size descendingly. All clusters are measured in
+    one pass over the clusters' voxels.
+    """
     if not source_data.shape == cluster_data.shape:
         print 'Inconsistent data shape.'
         return
-    cluster_info = []
-    cluster_idx = np.unique(cluster_data)
-    for idx in cluster_idx:
-        if idx:
-            mask = cluster_data.copy()
-            mask[mask!=idx] = 0
-            mask[mask==idx] = 1
-            extent = mask.sum()
-            masked_src = source_data * mask
-            max_val = masked_src.max()
-            max_coord = np.unravel_index(masked_src.argmax(),
-                                         masked_src.shape)
-            max_coord = apply_affine(image_affine, np.array(max_coord))
-            cluster_info.append([idx, max_val, max_coord[0], max_coord[1],
-                                 max_coord[2], extent])
-    cluster_info = np.array(cluster_info)
-    cluster_extent = cluster_info[..., -1]
-    cluster_info = cluster_info[np.argsort(cluster_extent)[::-1]]
+    coords = np.nonzero(cluster_data)
+    cluster_idx, inverse = np.unique(cluster_data[coords], return_inverse=True)
+    n_cluster = cluster_idx.shape[0]
+    if not n_cluster:
+        return np.zeros((0, 10))
+    values = source_data[coords].astype(np.float)
+
+    extent = np.bincount(inverse, minlength=n_cluster)
+    mean_val = np.bincount(inverse, values, n_cluster) / extent
+    center = np.column_stack([np.bincount(inverse, c, n_cluster) / extent
+                              for c in coords])
+    # the peak is the first voxel (in C order) with the cluster's max value
+    order = np.lexsort((-values, inverse))
+    peak = order[np.searchsorted(inverse[order], np.arange(n_cluster))]
+    max_coord = np.column_stack([c[peak] for c in coords])
+
+    cluster_info = np.column_stack((cluster_idx, values[peak],
+                                    apply_affine(image_affine, max_coord),
+                                    extent, mean_val,
+                                    apply_affine(image_affine, center)))
+    cluster_info = cluster_info[np.argsort(extent, kind='mergesort')[::-1]]
     return cluster_info
@@ -2,11 +2,15 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 import os
+import hashlib
+import weakref
+import itertools
 import subprocess
 import numpy as np
 
 from scipy import sparse
-from scipy.spatial.distance import cdist, pdist
+from scipy.sparse import csgraph
+from scipy.spatial import cKDTree
 from scipy.stats import pearsonr
 
 
@@ -81,7 +85,7 @@ def compute_normals(rr, tris):
     return nn
 
 
-def find_closest_vertices(surface_coords, point_coords):
+def find_closest_vertices(surface_coords, point_coords, tree=None):
     """Return the vertices on a surface mesh closest to some 
     given coordinates.
 
@@ -93,6 +97,9 @@ def find_closest_vertices(surface_coords, point_coords):
         Array of coordinates on a surface mesh
     point_coords : numpy array
         Array of coordinates to map to vertices
+    tree : cKDTree | None
+        A KD-tree of the surface_coords, such as Geometry.get_kdtree().
+        If None, it is built from the surface_coords.
 
     Returns
     -------
@@ -101,7 +108,9 @@ def find_closest_vertices(surface_coords, point_coords):
 
     """
     point_coords = np.atleast_2d(point_coords)
-    return np.argmin(cdist(surface_coords, point_coords), axis=0)
+    if tree is None:
+        tree = cKDTree(surface_coords)
+    return tree.query(point_coords)[1]
 
 
 def tal_to_mni(coords):
@@ -462,6 +471,74 @@ def ffmpeg(dst, frame_path, framerate=24, codec='mpeg4', bitrate='1M'):
         raise RuntimeError(err)
 
 
+class VertexNeighbors(object):
+    """
+    Neighbors of each vertex of a mesh stored in the CSR format.
+
+    The neighbors of the vertex i are indices[indptr[i]:indptr[i+1]],
+    sorted ascendingly. The object can be used in place of a list whose
+    elements are collections of neighbors: len(obj) is the number of
+    vertices, obj[i] is an array of the vertex i's neighbors, and iterating
+    over it yields the neighbors of each vertex in turn.
+    """
+
+    def __init__(self, indptr, indices):
+        """
+        Parameters
+        ----------
+        indptr : 1-D numpy array
+            the start position of each vertex's neighbors in indices,
+            with the shape [n_vertices + 1]
+        indices : 1-D numpy array
+            the neighbors of all vertices
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+
+    @classmethod
+    def from_csr(cls, csr):
+        """Make a instance from the nonzero pattern of a sparse matrix."""
+        csr = sparse.csr_matrix(csr)
+        csr.sort_indices()
+        return cls(csr.indptr, csr.indices)
+
+    @classmethod
+    def from_list(cls, neighbors):
+        """Make a instance from a list whose elements are collections of neighbors."""
+        n_vtx = len(neighbors)
+        degrees = [len(i) for i in neighbors]
+        rows = np.repeat(np.arange(n_vtx), degrees)
+        cols = np.fromiter(itertools.chain.from_iterable(neighbors), dtype=np.int,
+                           count=np.sum(degrees))
+        data = np.ones(rows.shape[0], dtype=np.int8)
+        return cls.from_csr(sparse.coo_matrix((data, (rows, cols)), shape=(n_vtx, n_vtx)))
+
+    def __len__(self):
+        return self.indptr.shape[0] - 1
+
+    def __getitem__(self, vtx):
+        return self.indices[self.indptr[vtx]:self.indptr[vtx+1]]
+
+    def __iter__(self):
+        for vtx in range(len(self)):
+            yield self[vtx]
+
+    def degrees(self):
+        """Return the number of each vertex's neighbors."""
+        return np.diff(self.indptr)
+
+    def tocsr(self):
+        """Return a binary adjacency matrix of the neighborhood."""
+        n_vtx = len(self)
+        data = np.ones(self.indices.shape[0], dtype=np.int8)
+        return sparse.csr_matrix((data, self.indices, self.indptr),
+                                 shape=(n_vtx, n_vtx))
+
+    def tolist(self):
+        """Return a list whose elements are sets of each vertex's neighbors."""
+        return [set(neighbors) for neighbors in self]
+
+
 def get_n_ring_neighbor(faces, n=1, ordinal=False, mask=None):
     """
     get n ring neighbor from faces array
@@ -480,10 +557,13 @@ def get_n_ring_neighbor(faces, n=1, ordinal=False, mask=None):
         non-ROI element's value is zero
     Returns
     -------
-    lists
-        each index of the list represents a vertex number
-        each element is a set which includes neighbors of corresponding vertex
+    VertexNeighbors
+        each index of it represents a vertex number
+        each element is a array which includes neighbors of corresponding vertex
     """
+    if n < 1:
+        raise RuntimeError("The number of rings should be equal or greater than 1!")
+
     n_vtx = np.max(faces) + 1  # get the number of vertices
     if mask is not None and np.nonzero(mask)[0].shape[0] == n_vtx:
         # In this case, the mask covers all vertices and is equal to have no mask (None).
@@ -491,54 +571,35 @@ def get_n_ring_neighbor(faces, n=1, ordinal=False, mask=None):
         mask = None
 
     # find 1_ring neighbors' id for each vertex
-    coo_w = mesh_edges(faces)
-    csr_w = coo_w.tocsr()
-    if mask is None:
-        vtx_iter = range(n_vtx)
-        n_ring_neighbors = [csr_w.indices[csr_w.indptr[i]:csr_w.indptr[i+1]] for i in vtx_iter]
-        n_ring_neighbors = [set(i) for i in n_ring_neighbors]
-    else:
-        mask_id = np.nonzero(mask)[0]
-        vtx_iter = mask_id
-        n_ring_neighbors = [set(csr_w.indices[csr_w.indptr[i]:csr_w.indptr[i+1]])
-                            if mask[i] != 0 else set() for i in range(n_vtx)]
-        for vtx in vtx_iter:
-            neighbor_set = n_ring_neighbors[vtx]
-            neighbor_iter = list(neighbor_set)
-            for i in neighbor_iter:
-                if mask[i] == 0:
-                    neighbor_set.discard(i)
-
-    if n > 1:
-        # find n_ring neighbors
-        one_ring_neighbors = [i.copy() for i in n_ring_neighbors]
-        n_th_ring_neighbors = [i.copy() for i in n_ring_neighbors]
-        # if n>1, go to get more neighbors
-        for i in range(n-1):
-            for neighbor_set in n_th_ring_neighbors:
-                neighbor_set_tmp = neighbor_set.copy()
-                for v_id in neighbor_set_tmp:
-                    neighbor_set.update(one_ring_neighbors[v_id])
-
-            if i == 0:
-                for v_id in vtx_iter:
-                    n_th_ring_neighbors[v_id].remove(v_id)
-
-            for v_id in vtx_iter:
-                n_th_ring_neighbors[v_id] -= n_ring_neighbors[v_id]  # get the (i+2)_th ring neighbors
-                n_ring_neighbors[v_id] |= n_th_ring_neighbors[v_id]  # get the (i+2) ring neighbors
-    elif n == 1:
-        n_th_ring_neighbors = n_ring_neighbors
-    else:
-        raise RuntimeError("The number of rings should be equal or greater than 1!")
+    one_ring = mesh_edges(faces).tocsr()
+    one_ring.data[:] = 1
+    if mask is not None:
+        # remove edges which connect with the vertices out of the mask
+        mask_diag = sparse.diags((np.asarray(mask) != 0).astype(np.float), 0)
+        one_ring = mask_diag * one_ring * mask_diag
+        one_ring.eliminate_zeros()
+
+    # The vertices reachable from v within k edges are the nonzero
+    # elements of v's row in (A + I)^k, where A is the adjacency matrix.
+    step = (one_ring + sparse.identity(n_vtx, format='csr')).tocsr()
+    reach = step
+    reach_old = None
+    for i in range(n-1):
+        reach_old = reach
+        reach = reach * step
+        reach.data[:] = 1
 
-    if ordinal:
-        return n_th_ring_neighbors
+    if ordinal and reach_old is not None:
+        n_ring_neighbors = reach - reach_old
     else:
-        return n_ring_neighbors
+        n_ring_neighbors = reach - sparse.identity(n_vtx, format='csr')
+    n_ring_neighbors = sparse.csr_matrix(n_ring_neighbors)
+    n_ring_neighbors.eliminate_zeros()
 
+    return VertexNeighbors.from_csr(n_ring_neighbors)
 
-def get_vtx_neighbor(vtx, faces, n=1, ordinal=False, mask=None):
+
+def get_vtx_neighbor(vtx, faces, n=1, ordinal=False, mask=None, topology=None):
     """
     Get one vertex's n-ring neighbor vertices
 
@@ -555,31 +616,18 @@ def get_vtx_neighbor(vtx, faces, n=1, ordinal=False, mask=None):
         False: get the n ring neighbor
     mask : 1-D numpy array
         specify a area where the ROI is in.
+    topology : MeshTopology
+        the topology of the faces. If None, the shared one is got by
+        get_topology, which hashes the faces.
 
     Return
     ------
     neighbors : set
         contain neighbors of the vtx
     """
-    n_ring_neighbors = _get_vtx_neighbor(vtx, faces, mask)
-    n_th_ring_neighbors = n_ring_neighbors.copy()
-
-    for i in range(n-1):
-
-        neighbors_tmp = set()
-        for neighbor in n_th_ring_neighbors:
-            neighbors_tmp.update(_get_vtx_neighbor(neighbor, faces, mask))
-
-        if i == 0:
-            neighbors_tmp.discard(vtx)
-
-        n_th_ring_neighbors = neighbors_tmp.difference(n_ring_neighbors)
-        n_ring_neighbors.update(n_th_ring_neighbors)
-
-    if ordinal:
-        return n_th_ring_neighbors
-    else:
-        return n_ring_neighbors
+    if topology is None:
+        topology = get_topology(faces)
+    return topology.vertex_n_ring(vtx, n, ordinal, mask)
 
 
 def _get_vtx_neighbor(vtx, faces, mask=None):
@@ -600,16 +648,289 @@ def _get_vtx_neighbor(vtx, faces, mask=None):
     neighbors : set
         contain neighbors of the vtx
     """
-    row_indices, _ = np.where(faces == vtx)
-    neighbors = set(np.unique(faces[row_indices]))
-    neighbors.discard(vtx)
-    if mask is not None:
-        neighbor_iter = list(neighbors)
-        for i in neighbor_iter:
-            if mask[i] == 0:
-                neighbors.discard(i)
+    return get_vtx_neighbor(vtx, faces, mask=mask)
 
-    return neighbors
+
+class MeshTopology(object):
+    """
+    Per-vertex topology index of a mesh, which is independent of coordinates.
+
+    The vertex-to-face incidence, the n-ring neighbors and the edge list
+    are built from the faces at the first request and kept. A single
+    vertex's neighbors are found from the incidence in O(degree) time,
+    without building the neighbors of all vertices. Use get_topology to
+    share one instance among all meshes with identical faces.
+    """
+
+    def __init__(self, faces):
+        """
+        Parameters
+        ----------
+        faces : numpy array
+            the array of shape [n_triangles, 3]
+        """
+        self.faces = faces
+        self.n_vtx = np.max(faces) + 1
+        self._vertex_faces = None
+        self._neighbors = {}
+        self._edges = None
+
+    def vertex_faces(self):
+        """
+        Return the faces including each vertex.
+
+        Return
+        ------
+        VertexNeighbors
+            the element i is the array of the indices of the faces which
+            include the vertex i
+        """
+        if self._vertex_faces is None:
+            n_face = self.faces.shape[0]
+            rows = self.faces.ravel()
+            cols = np.repeat(np.arange(n_face), self.faces.shape[1])
+            data = np.ones(rows.shape[0], dtype=np.int8)
+            incidence = sparse.coo_matrix((data, (rows, cols)), shape=(self.n_vtx, n_face))
+            self._vertex_faces = VertexNeighbors.from_csr(incidence)
+        return self._vertex_faces
+
+    def neighbors(self, n=1):
+        """Return the n-ring neighbors of each vertex, which are cached for each n."""
+        if n not in self._neighbors:
+            self._neighbors[n] = get_n_ring_neighbor(self.faces, n)
+        return self._neighbors[n]
+
+    def add_neighbors(self, neighbors, n=1):
+        """Cache the precomputed n-ring neighbors if they haven't been computed."""
+        self._neighbors.setdefault(n, neighbors)
+
+    def edges(self):
+        """Return the row and column indices of the directed edges, each edge is included twice."""
+        if self._edges is None:
+            self._edges = _edge_arrays(self.neighbors())
+        return self._edges
+
+    def vertex_neighbors(self, vtx, mask=None):
+        """
+        Return one vertex's 1-ring neighbors.
+
+        Parameters
+        ----------
+        vtx : integer
+            a vertex's id
+        mask : 1-D numpy array
+            If not None, only the neighbors in the mask are returned.
+
+        Return
+        ------
+        neighbors : numpy array
+        """
+        neighbors = np.unique(self.faces[self.vertex_faces()[vtx]])
+        neighbors = neighbors[neighbors != vtx]
+        if mask is not None:
+            neighbors = neighbors[np.asarray(mask)[neighbors] != 0]
+        return neighbors
+
+    def vertex_n_ring(self, vtx, n=1, ordinal=False, mask=None):
+        """
+        Return one vertex's n-ring neighbors by a breadth-first search.
+
+        Parameters
+        ----------
+        vtx : integer
+            a vertex's id
+        n : integer
+            specify which ring should be got
+        ordinal : bool
+            True: get the n_th ring neighbor
+            False: get the n ring neighbor
+        mask : 1-D numpy array
+            specify a area where the ROI is in. Only the paths in the area
+            are searched.
+
+        Return
+        ------
+        neighbors : set
+            contain neighbors of the vtx
+        """
+        visited = set([vtx])
+        ring = [vtx]
+        for i in range(n):
+            if not ring:
+                break
+            candidates = np.concatenate([self.vertex_neighbors(v, mask) for v in ring])
+            ring = set(candidates.tolist()).difference(visited)
+            visited.update(ring)
+        visited.discard(vtx)
+
+        if ordinal:
+            return set(ring)
+        else:
+            return visited
+
+
+# The topologies in use, keyed by the hash of their faces.
+_topologies = weakref.WeakValueDictionary()
+# The last topology got, kept alive for repeated calls with the same faces.
+_last_topology = [None]
+
+
+def get_topology(faces):
+    """
+    Return the MeshTopology of the faces, which is shared by identical faces.
+
+    Identical face arrays are detected by their hash. As long as the
+    topology is referred, the faces are stored once and its neighbors and
+    edges are computed once for all meshes with the faces, such as the
+    white, pial and inflated surfaces of a subject or the surfaces of many
+    subjects on a same template.
+
+    Parameters
+    ----------
+    faces : numpy array
+        the array of shape [n_triangles, 3]
+
+    Return
+    ------
+    topology : MeshTopology
+        Its faces can be used in place of the argument faces.
+    """
+    faces = np.ascontiguousarray(faces)
+    key = (faces.shape, faces.dtype.str, hashlib.md5(faces).hexdigest())
+    topology = _topologies.get(key)
+    if topology is None or not np.array_equal(topology.faces, faces):
+        topology = MeshTopology(faces)
+        _topologies[key] = topology
+    _last_topology[0] = topology
+    return topology
+
+
+def mesh_edge_lengths(coords, faces, edges=None):
+    """
+    Return the mesh's edges weighted by their lengths.
+
+    Parameters
+    ----------
+    coords : numpy array
+        the array of shape [n_vertices, 3]
+    faces : numpy array
+        the array of shape [n_triangles, 3]
+    edges : tuple | None
+        the row and column indices of the directed edges, such as the
+        ones returned by MeshTopology.edges. If None, they are got from
+        the faces.
+
+    Return
+    ------
+    graph : sparse matrix
+        a symmetric CSR matrix, graph[i, j] is the length of the edge (i, j)
+    """
+    if edges is None:
+        edges = mesh_edges(faces)
+        edges = (edges.row, edges.col)
+    row, col = edges
+    lengths = np.sqrt(np.sum(np.square(coords[row] - coords[col]), 1))
+    n_vtx = coords.shape[0]
+    return sparse.csr_matrix((lengths, (row, col)), shape=(n_vtx, n_vtx))
+
+
+def geodesic_distance(graph, sources, max_distance=np.inf, return_predecessors=False):
+    """
+    Calculate the geodesic distance from the nearest source to each vertex.
+
+    Dijkstra's algorithm runs on the edge-length-weighted graph and stops
+    at max_distance.
+
+    Parameters
+    ----------
+    graph : sparse matrix
+        the weighted graph, such as the one returned by mesh_edge_lengths
+    sources : integer | sequence
+        the source vertices
+    max_distance : float
+        Vertices farther than this distance are not reached.
+    return_predecessors : bool
+        If True, also return the predecessor of each vertex on its
+        shortest path from the nearest source.
+
+    Returns
+    -------
+    dist : numpy array
+        the distances, inf for the unreached vertices
+    predecessors : numpy array
+        -9999 for the sources and the unreached vertices
+    """
+    graph = sparse.csr_matrix(graph)
+    n_vtx = graph.shape[0]
+    sources = np.unique(np.atleast_1d(sources))
+    # One search starts from a virtual vertex linked to every source by a
+    # zero-weight edge (an explicit zero is an edge for csgraph), so the
+    # memory doesn't grow with the number of sources.
+    n_source = sources.shape[0]
+    indptr = np.r_[graph.indptr, graph.indptr[-1] + n_source]
+    indices = np.r_[graph.indices, sources]
+    data = np.r_[graph.data, np.zeros(n_source)]
+    graph = sparse.csr_matrix((data, indices, indptr), shape=(n_vtx + 1, n_vtx + 1))
+    result = csgraph.dijkstra(graph, directed=False, indices=n_vtx,
+                              return_predecessors=return_predecessors,
+                              limit=max_distance)
+    if return_predecessors:
+        dist, predecessors = result
+        predecessors = predecessors[:n_vtx]
+        predecessors[predecessors == n_vtx] = -9999
+        return dist[:n_vtx], predecessors
+    return result[:n_vtx]
+
+
+def geodesic_disc(graph, centers, radius):
+    """
+    Find the vertices within the geodesic radius of any center.
+
+    Parameters
+    ----------
+    graph : sparse matrix
+        the weighted graph, such as the one returned by mesh_edge_lengths
+    centers : integer | sequence
+        the center vertices
+    radius : float
+
+    Return
+    ------
+    vertices : numpy array
+        the vertices in the disc, including the centers
+    """
+    dist = geodesic_distance(graph, centers, max_distance=radius)
+    return np.nonzero(dist <= radius)[0]
+
+
+def geodesic_path(graph, start, end, max_distance=np.inf):
+    """
+    Return the geodesic shortest path between start and end.
+
+    Parameters
+    ----------
+    graph : sparse matrix
+        the weighted graph, such as the one returned by mesh_edge_lengths
+    start : integer
+        path's start vertex's id
+    end : integer
+        path's end vertex's id
+    max_distance : float
+        Give up if the path is longer than this distance.
+
+    Return
+    ------
+    path : list
+        the vertices from start to end
+        If the list is empty, there isn't a path within max_distance.
+    """
+    dist, predecessors = geodesic_distance(graph, start, max_distance, True)
+    if np.isinf(dist[end]):
+        return []
+    path = [end]
+    while path[-1] != start:
+        path.append(predecessors[path[-1]])
+    return [int(v) for v in path[::-1]]
 
 
 def mesh2edge_list(faces, n=1, ordinal=False, mask=None, vtx_signal=None,
@@ -642,61 +963,108 @@ def mesh2edge_list(faces, n=1, ordinal=False, mask=None, vtx_signal=None,
 
     Returns
     -------
-    row_ind : list
+    row_ind : numpy array
         row indices of edges
-    col_ind : list
+    col_ind : numpy array
         column indices of edges
-    edge_data : list
+    edge_data : numpy array
         edge data of the edges-zip(row_ind, col_ind)
     """
     n_ring_neighbors = get_n_ring_neighbor(faces, n, ordinal, mask)
 
-    row_ind = [i for i, neighbors in enumerate(n_ring_neighbors) for v_id in neighbors]
-    col_ind = [v_id for neighbors in n_ring_neighbors for v_id in neighbors]
+    row_ind = np.repeat(np.arange(len(n_ring_neighbors)), n_ring_neighbors.degrees())
+    col_ind = n_ring_neighbors.indices
     if vtx_signal is None:
         # create unweighted edges
         n_edge = len(row_ind)  # the number of edges
         edge_data = np.ones(n_edge)
     else:
         # calculate weights according to mesh's geometry and vertices' signal
-        if weight_type[0] == 'dissimilar':
-            if weight_type[1] == 'euclidean':
-                edge_data = [pdist(vtx_signal[[i, j]], metric=weight_type[1])[0]
-                             for i, j in zip(row_ind, col_ind)]
-            elif weight_type[1] == 'relative_euclidean':
-                edge_data = []
-                for i, j in zip(row_ind, col_ind):
-                    euclidean = pdist(vtx_signal[[i, j]], metric='euclidean')[0]
-                    sum_ij = np.sum(abs(vtx_signal[[i, j]]))
-                    if sum_ij:
-                        edge_data.append(float(euclidean) / sum_ij)
-                    else:
-                        edge_data.append(0)
-            else:
-                raise RuntimeError("The weight_type-{} is not supported now!".format(weight_type))
-
-            if weight_normalization:
-                max_dissimilar = np.max(edge_data)
-                min_dissimilar = np.min(edge_data)
-                edge_data = [(max_dissimilar-dist)/(max_dissimilar-min_dissimilar) for dist in edge_data]
-
-        elif weight_type[0] == 'similar':
-            if weight_type[1] == 'pearson correlation':
-                edge_data = [pearsonr(vtx_signal[i], vtx_signal[j])[0] for i, j in zip(row_ind, col_ind)]
-            elif weight_type[1] == 'mean':
-                edge_data = [np.mean(vtx_signal[[i, j]]) for i, j in zip(row_ind, col_ind)]
+        edge_data = _edge_weights(vtx_signal, row_ind, col_ind, weight_type)
+
+        if weight_normalization:
+            max_weight = np.max(edge_data)
+            min_weight = np.min(edge_data)
+            if weight_type[0] == 'dissimilar':
+                edge_data = (max_weight - edge_data) / (max_weight - min_weight)
             else:
-                raise RuntimeError("The weight_type-{} is not supported now!".format(weight_type))
+                edge_data = (edge_data - min_weight) / (max_weight - min_weight)
+
+    return row_ind, col_ind, edge_data
+
+
+def _edge_weights(vtx_signal, row_ind, col_ind, weight_type, chunk_size=2**22):
+    """
+    Calculate the weight of each edge from its two vertices' signal.
 
-            if weight_normalization:
-                max_similar = np.max(edge_data)
-                min_similar = np.min(edge_data)
-                edge_data = [(simi-min_similar)/(max_similar-min_similar) for simi in edge_data]
+    The edges are processed in blocks, and each block holds no more than
+    about chunk_size elements of the signal, which bounds the memory usage.
+
+    Parameters
+    ----------
+    vtx_signal : numpy array
+        NxM array, N is the number of vertices,
+        M is the number of measurements and time points.
+    row_ind : numpy array
+        row indices of edges
+    col_ind : numpy array
+        column indices of edges
+    weight_type : (str1, str2)
+        see mesh2edge_list
+    chunk_size : integer
 
+    Return
+    ------
+    edge_data : numpy array
+    """
+    vtx_signal = np.asarray(vtx_signal, dtype=np.float64)
+    if vtx_signal.ndim == 1:
+        vtx_signal = vtx_signal.reshape((-1, 1))
+    n_feature = vtx_signal.shape[1]
+
+    if weight_type[0] == 'dissimilar':
+        if weight_type[1] == 'euclidean':
+            pass
+        elif weight_type[1] == 'relative_euclidean':
+            abs_sum = np.sum(np.abs(vtx_signal), 1)
         else:
-            raise TypeError("The weight_type-{} is not supported now!".format(weight_type))
+            raise RuntimeError("The weight_type-{} is not supported now!".format(weight_type))
+    elif weight_type[0] == 'similar':
+        if weight_type[1] == 'pearson correlation':
+            # demean and normalize each vertex's signal to unit length,
+            # then the correlation is the dot product of a couple of rows.
+            vtx_signal = vtx_signal - np.mean(vtx_signal, 1)[:, None]
+            norm = np.sqrt(np.sum(vtx_signal ** 2, 1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vtx_signal = vtx_signal / norm[:, None]
+        elif weight_type[1] == 'mean':
+            signal_sum = np.sum(vtx_signal, 1)
+            return (signal_sum[row_ind] + signal_sum[col_ind]) / (2.0 * n_feature)
+        else:
+            raise RuntimeError("The weight_type-{} is not supported now!".format(weight_type))
+    else:
+        raise TypeError("The weight_type-{} is not supported now!".format(weight_type))
+
+    edge_data = np.zeros(len(row_ind))
+    step = max(1, chunk_size // n_feature)
+    for start in range(0, len(row_ind), step):
+        rows = row_ind[start:start+step]
+        cols = col_ind[start:start+step]
+        if weight_type[1] == 'pearson correlation':
+            edge_data[start:start+step] = np.sum(vtx_signal[rows] * vtx_signal[cols], 1)
+        else:
+            diff = vtx_signal[rows] - vtx_signal[cols]
+            edge_data[start:start+step] = np.sqrt(np.sum(diff ** 2, 1))
 
-    return row_ind, col_ind, edge_data
+    if weight_type[1] == 'relative_euclidean':
+        sum_ij = abs_sum[row_ind] + abs_sum[col_ind]
+        nonzero = sum_ij != 0
+        edge_data[nonzero] /= sum_ij[nonzero]
+        edge_data[~nonzero] = 0
+    elif weight_type[1] == 'pearson correlation':
+        np.clip(edge_data, -1, 1, out=edge_data)
+
+    return edge_data
 
 
 def mesh2adjacent_matrix(faces, n=1, ordinal=False, mask=None, vtx_signal=None,
@@ -786,12 +1154,26 @@ def mesh2graph(faces, n=1, ordinal=False, mask=None, vtx_signal=None,
     # add_weighted_edges_from is also faster than default constructor
     # To get more related information, please refer to
     # http://stackoverflow.com/questions/24681677/transform-csr-matrix-into-networkx-graph
-    graph.add_weighted_edges_from(zip(row_ind, col_ind, edge_data))
+    graph.add_weighted_edges_from(zip(row_ind.tolist(), col_ind.tolist(), edge_data.tolist()))
 
     return graph
 
 
-def binary_shrink(bin_data, faces, n=1, n_ring_neighbors=None):
+def _vertex_neighbors(faces, n=1, neighbors=None):
+    """Return the neighbors as a VertexNeighbors, which are got from faces if they are None."""
+    if neighbors is None:
+        return get_n_ring_neighbor(faces, n)
+    if not isinstance(neighbors, VertexNeighbors):
+        return VertexNeighbors.from_list(neighbors)
+    return neighbors
+
+
+def _edge_arrays(neighbors):
+    """Return the row and column indices of the edges in a VertexNeighbors."""
+    return np.repeat(np.arange(len(neighbors)), neighbors.degrees()), neighbors.indices
+
+
+def binary_shrink(bin_data, faces, n=1, n_ring_neighbors=None, iterations=1):
     """
     shrink bin_data
 
@@ -799,40 +1181,38 @@ def binary_shrink(bin_data, faces, n=1, n_ring_neighbors=None):
     ----------
     bin_data : 1-D numpy array
         Each array index is corresponding to vertex id in the faces.
-        Each element is a bool.
+        Each element is a bool, or a label id for multi-label data.
     faces : numpy array
         the array of shape [n_triangles, 3]
     n : integer
         specify which ring should be got
-    n_ring_neighbors : list
+    n_ring_neighbors : list | VertexNeighbors
         If this parameter is not None, two parameters ('faces', 'n') will be ignored.
         It is used to save time when someone repeatedly uses the function with
             a same n_ring_neighbors which can be got by get_n_ring_neighbor.
         The indices are vertices' id of a mesh.
         One index's corresponding element is a collection of vertices which connect with the index.
+    iterations : integer
+        the number of times the shrink is repeated
 
     Return
     ------
-    new_data : 1-D numpy array with bool elements
+    new_data : 1-D numpy array
         The output of the bin_data after binary shrink
+        A vertex is kept only if all its neighbors have the same value with it.
     """
-    if bin_data.dtype != np.bool:
-        raise TypeError("The input dtype must be bool")
-    vertices = np.where(bin_data)[0]
-    new_data = np.zeros_like(bin_data)
-
-    if n_ring_neighbors is None:
-        n_ring_neighbors = get_n_ring_neighbor(faces, n)
+    n_ring_neighbors = _vertex_neighbors(faces, n, n_ring_neighbors)
+    row_ind, col_ind = _edge_arrays(n_ring_neighbors)
 
-    for v_id in vertices:
-        neighbors_values = [bin_data[_] for _ in n_ring_neighbors[v_id]]
-        if np.all(neighbors_values):
-            new_data[v_id] = True
+    new_data = bin_data.copy()
+    for _ in range(iterations):
+        differ = new_data[row_ind] != new_data[col_ind]
+        new_data[row_ind[differ]] = 0
 
     return new_data
 
 
-def binary_expand(bin_data, faces, n=1, n_ring_neighbors=None):
+def binary_expand(bin_data, faces, n=1, n_ring_neighbors=None, iterations=1):
     """
     expand bin_data
 
@@ -840,35 +1220,38 @@ def binary_expand(bin_data, faces, n=1, n_ring_neighbors=None):
     ----------
     bin_data : 1-D numpy array
         Each array index is corresponding to vertex id in the faces.
-        Each element is a bool.
+        Each element is a bool, or a label id for multi-label data.
     faces : numpy array
         the array of shape [n_triangles, 3]
     n : integer
         specify which ring should be got
-    n_ring_neighbors : list
+    n_ring_neighbors : list | VertexNeighbors
         If this parameter is not None, two parameters ('faces' and 'n') will be ignored.
         It is used to save time when someone repeatedly uses the function with
             a same n_ring_neighbors which can be got by get_n_ring_neighbor.
         The indices are vertices' id of a mesh.
         One index's corresponding element is a collection of vertices which connect with the index.
+    iterations : integer
+        the number of times the expand is repeated
 
     Return
     ------
-    new_data : 1-D numpy array with bool elements
+    new_data : 1-D numpy array
         The output of the bin_data after binary expand
+        A zero vertex gets the maximal value of its neighbors, and
+        the nonzero vertices are kept.
     """
-    if bin_data.dtype != np.bool:
-        raise TypeError("The input dtype must be bool")
-    vertices = np.where(bin_data)[0]
-    new_data = bin_data.copy()
-
-    if n_ring_neighbors is None:
-        n_ring_neighbors = get_n_ring_neighbor(faces, n)
+    n_ring_neighbors = _vertex_neighbors(faces, n, n_ring_neighbors)
+    starts = n_ring_neighbors.indptr[:-1]
+    has_neighbor = n_ring_neighbors.degrees() > 0
 
-    for v_id in vertices:
-        neighbors_values = [bin_data[_] for _ in n_ring_neighbors[v_id]]
-        if not np.all(neighbors_values):
-            new_data[list(n_ring_neighbors[v_id])] = True
+    new_data = bin_data.copy()
+    for _ in range(iterations):
+        neighbors_max = np.zeros_like(new_data)
+        if np.any(has_neighbor):
+            neighbors_max[has_neighbor] = np.maximum.reduceat(new_data[n_ring_neighbors.indices],
+                                                              starts[has_neighbor])
+        new_data = np.where(new_data != 0, new_data, neighbors_max)
 
     return new_data
 
@@ -889,7 +1272,7 @@ def label_edge_detection(data, faces, edge_type="inner", neighbors=None):
         "outer" means outer edges of labels.
         "both" means both of them in one array
         "split" means returning inner and outer edges in two arrays respectively
-    neighbors : list
+    neighbors : list | VertexNeighbors
         If this parameter is not None, a parameters ('faces') will be ignored.
         It is used to save time when someone repeatedly uses the function with
             a same neighbors which can be got by get_n_ring_neighbor.
@@ -906,22 +1289,22 @@ def label_edge_detection(data, faces, edge_type="inner", neighbors=None):
             be not strictly corresponding to labels' id when
             there are some labels which are too close.
     """
-    # data preparation
-    vertices = np.nonzero(data)[0]
+    if edge_type not in ("inner", "outer", "both", "split"):
+        raise ValueError("The argument 'edge_type' must be one of the (inner, outer, both, split)")
+
+    # find the edges from a labeled vertex to a vertex with another value
+    neighbors = _vertex_neighbors(faces, neighbors=neighbors)
+    row_ind, col_ind = _edge_arrays(neighbors)
+    cut = np.logical_and(data[row_ind] != 0, data[row_ind] != data[col_ind])
+    row_ind = row_ind[cut]
+    col_ind = col_ind[cut]
+
     inner_data = np.zeros_like(data)
     outer_data = np.zeros_like(data)
-    if neighbors is None:
-        neighbors = get_n_ring_neighbor(faces)
-
-    # look for edges
-    for v_id in vertices:
-        neighbors_values = [data[_] for _ in neighbors[v_id]]
-        if min(neighbors_values) != max(neighbors_values):
-            if edge_type in ("inner", "both", "split"):
-                inner_data[v_id] = data[v_id]
-            if edge_type in ("outer", "both", "split"):
-                outer_vtx = [vtx for vtx in neighbors[v_id] if data[v_id] != data[vtx]]
-                outer_data[outer_vtx] = data[v_id]
+    inner_data[row_ind] = data[row_ind]
+    # an outer vertex gets the label of its last (largest) inner neighbor
+    col_rev, last = np.unique(col_ind[::-1], return_index=True)
+    outer_data[col_rev] = data[row_ind[::-1][last]]
 
     # return results
     if edge_type == "inner":
@@ -930,10 +1313,8 @@ def label_edge_detection(data, faces, edge_type="inner", neighbors=None):
         return outer_data
     elif edge_type == "both":
         return inner_data + outer_data
-    elif edge_type == "split":
-        return inner_data, outer_data
     else:
-        raise ValueError("The argument 'edge_type' must be one of the (inner, outer, both, split)")
+        return inner_data, outer_data
 
 
 def get_patch_by_crg(vertices, neighbors_list):
@@ -943,23 +1324,106 @@ def get_patch_by_crg(vertices, neighbors_list):
     The function is similar as connected component detection in graph theory.
 
     :param vertices: set
-    :param neighbors_list: list
+    :param neighbors_list: list | VertexNeighbors
         The indices are vertices' id of a mesh.
         One index's corresponding element is a collection of vertices which connect with the index.
 
     :return: patches
         Each element of it is a collection of vertices, that is a patch.
     """
-    from froi.algorithm.regiongrow import RegionGrow
+    if not isinstance(neighbors_list, VertexNeighbors):
+        neighbors_list = VertexNeighbors.from_list(neighbors_list)
+    vertices = np.array(sorted(vertices), dtype=np.int)
+    adjacency = neighbors_list.tocsr()[vertices][:, vertices]
+    n_patch, labels = csgraph.connected_components(adjacency, directed=False)
+    order = np.argsort(labels, kind='mergesort')
+    bounds = np.cumsum(np.bincount(labels, minlength=n_patch))[:-1]
+    return [list(patch) for patch in np.split(vertices[order], bounds)]
+
+
+def vertex_areas(coords, faces):
+    """
+    Return the area of each vertex, which is one third of the total area
+    of the triangles around it.
+    """
+    tri_areas = np.sqrt(np.sum(np.square(_fast_cross_3d(coords[faces[:, 1]] - coords[faces[:, 0]],
+                                                          coords[faces[:, 2]] - coords[faces[:, 0]])), 1)) / 2
+    return np.bincount(faces.ravel(), np.repeat(tri_areas, 3), coords.shape[0]) / 3
+
+
+def surface_cluster_labeling(faces, mask, neighbors=None):
+    """
+    Label the connected clusters of the masked vertices.
+
+    Parameters
+    ----------
+    faces : numpy array
+        the array of shape [n_triangles, 3]
+    mask : 1-D numpy array
+        nonzero for the vertices to be clustered
+    neighbors : list | VertexNeighbors
+        the 1-ring neighbors of each vertex. If not None, 'faces' will be
+        ignored.
+
+    Returns
+    -------
+    labels : numpy array
+        the cluster label (1 to n_cluster) of each vertex, 0 outside the mask
+    n_cluster : integer
+    """
+    n_vtx = mask.shape[0]
+    if neighbors is None:
+        edges = mesh_edges(faces).tocsr()
+    else:
+        edges = _vertex_neighbors(faces, neighbors=neighbors).tocsr()
+    vertices = np.nonzero(mask)[0]
+    adjacency = edges[vertices][:, vertices]
+    n_cluster, cluster_labels = csgraph.connected_components(adjacency, directed=False)
+    labels = np.zeros(n_vtx, dtype=np.int)
+    labels[vertices] = cluster_labels + 1
+    return labels, n_cluster
+
+
+def surface_cluster_stats(labels, data, coords, faces, areas=None):
+    """
+    Get the clusters' peak value, peak vertex, size and area in one pass.
+
+    Parameters
+    ----------
+    labels : numpy array
+        the cluster label of each vertex, 0 outside the clusters
+    data : numpy array
+        the scalar data of each vertex
+    coords : numpy array
+        the array of shape [n_vertices, 3]
+    faces : numpy array
+        the array of shape [n_triangles, 3]
+    areas : numpy array | None
+        the area of each vertex. If None, it is got by vertex_areas.
+
+    Return
+    ------
+    cluster_info : numpy array
+        Each row is [index, peak value, peak X, peak Y, peak Z, size, area,
+        peak vertex], and the rows are sorted by the size descendingly.
+    """
+    vertices = np.nonzero(labels)[0]
+    cluster_idx, inverse = np.unique(labels[vertices], return_inverse=True)
+    n_cluster = cluster_idx.shape[0]
+    if not n_cluster:
+        return np.zeros((0, 8))
+    values = np.asarray(data, dtype=np.float).ravel()[vertices]
 
-    patches = []
-    while vertices:
-        seed = vertices.pop()
-        patch = RegionGrow().connectivity_grow([[seed]], neighbors_list)[0]
-        patches.append(list(patch))
-        vertices.difference_update(patch)
+    if areas is None:
+        areas = vertex_areas(coords, faces)
+    size = np.bincount(inverse, minlength=n_cluster)
+    area = np.bincount(inverse, areas[vertices], n_cluster)
+    order = np.lexsort((-values, inverse))
+    peak = order[np.searchsorted(inverse[order], np.arange(n_cluster))]
 
-    return patches
+    cluster_info = np.column_stack((cluster_idx, values[peak], coords[vertices[peak]],
+                                    size, area, vertices[peak]))
+    return cluster_info[np.argsort(size, kind='mergesort')[::-1]]
 
 
 class LabelAssessment(object):
@@ -979,7 +1443,7 @@ class LabelAssessment(object):
             scalar data with the shape (#vertices, #features)
         faces : numpy array
             the array of shape [n_triangles, 3]
-        neighbors : list
+        neighbors : list | VertexNeighbors
             If this parameter is not None, the parameter ('faces') will be ignored.
             It is used to save time when someone repeatedly uses the function with
                 a same neighbors which can be got by get_n_ring_neighbor.
@@ -993,25 +1457,26 @@ class LabelAssessment(object):
         assessed_value : float
             Larger is often better.
         """
-        label_data = np.zeros_like(data, dtype=np.int8)
-        label_data[label] = 1
-
-        inner_data = label_edge_detection(label_data, faces, "inner", neighbors)
-        inner_edge = np.nonzero(inner_data)[0]
-
-        count = 0
-        sum_tmp = 0
-        for vtx_i in inner_edge:
-            for vtx_o in neighbors[vtx_i]:
-                if label_data[vtx_o] == 0:
-                    couple_signal = data[[vtx_i, vtx_o]]
-                    euclidean = float(pdist(couple_signal)[0])
-                    if relative:
-                        denominator = np.sum(abs(couple_signal))
-                        euclidean = euclidean / denominator if denominator else 0
-                    sum_tmp += euclidean
-                    count += 1
-        return sum_tmp / float(count) if count else 0
+        data = np.reshape(data, (data.shape[0], -1))
+        neighbors = _vertex_neighbors(faces, neighbors=neighbors)
+        label_mask = np.zeros(data.shape[0], dtype=np.bool)
+        label_mask[label] = True
+
+        # find the edges from the label's inner edge to the outside
+        row_ind, col_ind = _edge_arrays(neighbors)
+        cut = np.logical_and(label_mask[row_ind], ~label_mask[col_ind])
+        if not np.any(cut):
+            return 0
+        inner_signal = data[row_ind[cut]]
+        outer_signal = data[col_ind[cut]]
+
+        euclidean = np.sqrt(np.sum(np.square(inner_signal - outer_signal), 1))
+        if relative:
+            denominator = np.sum(np.abs(inner_signal), 1) + np.sum(np.abs(outer_signal), 1)
+            nonzero = denominator != 0
+            euclidean[nonzero] /= denominator[nonzero]
+            euclidean[~nonzero] = 0
+        return np.mean(euclidean)
 
 
 if __name__ == '__main__':
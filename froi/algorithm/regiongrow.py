@@ -1,22 +1,52 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
+import heapq
+
 import numpy as np
+from scipy import sparse
 from scipy.spatial.distance import cdist, pdist
 
 from ..core.dataobject import Geometry
-from meshtool import mesh2graph, get_n_ring_neighbor
+from meshtool import mesh2graph, get_n_ring_neighbor, VertexNeighbors
 from graph_tool import graph2parcel
 from tools import slide_win_smooth
 
 
-def region_growing(image, coordinate, number):
-    """Give coordinate and size,return a region."""
-    # tmp_image store marks and rg_image store new image after region grow
-    nt = number
-    tmp_image = np.zeros_like(image)
-    rg_image = np.zeros_like(image)
-    image_shape = image.shape
+def _neighbor_offsets(connectivity=26):
+    """
+    Return the offsets from a voxel to its neighbors.
+
+    Parameters
+    ----------
+    connectivity : integer
+        6, 18 or 26. Two voxels are neighbors if they share a face (6),
+        a face or an edge (18), or a face, an edge or a corner (26).
+
+    Return
+    ------
+    offsets : list
+        Its elements are (dx, dy, dz) tuples.
+    """
+    max_dist = {6: 1, 18: 2, 26: 3}.get(connectivity)
+    if max_dist is None:
+        raise ValueError("The connectivity must be one of the (6, 18, 26)")
+
+    offsets = []
+    for offset in np.ndindex(3, 3, 3):
+        offset = tuple(i - 1 for i in offset)
+        if 0 < sum(map(abs, offset)) <= max_dist:
+            offsets.append(offset)
+    return offsets
 
+
+def region_growing(image, coordinate, number, connectivity=6):
+    """Give coordinate and size,return a region.
+
+    Starting from the seed voxel, the frontier voxel whose value is the
+    closest to the region's mean value is added to the region one by one,
+    until the region has `number` voxels.
+    """
+    image_shape = image.shape
     x = int(coordinate[0])
     y = int(coordinate[1])
     z = int(coordinate[2])
@@ -28,90 +58,65 @@ def region_growing(image, coordinate, number):
         print "The coordinate is out of the image range."
         return False
 
-    # initialize region_mean and region_size
-    region_mean = image[x, y, z]
+    offsets = _neighbor_offsets(connectivity)
+    rg_image = np.zeros_like(image)
+    # mark voxels which are in the region or the frontier
+    visited = np.zeros(image_shape[:3], dtype=np.bool)
+    visited[x, y, z] = True
+
+    # The frontier is split at the region mean value into a max-heap of the
+    # lower values and a min-heap of the higher values, so the voxel closest
+    # to the mean is on the top of one of them. Ties are broken by the
+    # smallest voxel coordinate.
+    lower = []
+    upper = []
+
+    voxel = (x, y, z)
+    region_sum = float(image[voxel])
+    region_mean = region_sum
     region_size = 0
-
-    # initialize neighbor_list with 10000 rows 4 columns
-    neighbor_free = 10000
-    neighbor_pos = -1
-    neighbor_list = np.zeros((neighbor_free, 4))
-
-    # 26 direct neighbor points
-    neighbors = [[1, 0, 0],
-                 [-1, 0, 0],
-                 [0, 1, 0],
-                 [0, -1, 0],
-                 [0, 0, -1],
-                 [0, 0, 1],
-                 [1, 1, 0],
-                 [1, 1, 1],
-                 [1, 1, -1],
-                 [0, 1, 1],
-                 [-1, 1, 1],
-                 [1, 0, 1],
-                 [1, -1, 1],
-                 [-1, -1, 0],
-                 [-1, -1, -1],
-                 [-1, -1, 1],
-                 [0, -1, -1],
-                 [1, -1, -1],
-                 [-1, 0, -1],
-                 [-1, 1, -1],
-                 [0, 1, -1],
-                 [0, -1, 1],
-                 [1, 0, -1],
-                 [1, -1, 0],
-                 [-1, 0, 1],
-                 [-1, 1, 0]]
-
-    while region_size < nt:
-        # (xn, yn, zn) store direct neighbor of seed point
-        for i in range(6):
-            xn = x + neighbors[i][0]
-            yn = y + neighbors[i][1]
-            zn = z + neighbors[i][2]
-
-            # ensure the coordinate is in the image
+    while region_size < number:
+        # add the direct neighbors of the new voxel to the frontier
+        for offset in offsets:
+            xn = voxel[0] + offset[0]
+            yn = voxel[1] + offset[1]
+            zn = voxel[2] + offset[2]
             inside = (xn >= 0) and (xn < image_shape[0]) and (yn >= 0) and \
                      (yn < image_shape[1]) and (zn >= 0) and (zn < image_shape[2])
-
-            # ensure the original flag 0 is not changed
-            if inside and tmp_image[xn, yn, zn] == 0:
-                # add this point to neighbor_list and mark it with 1
-                neighbor_pos = neighbor_pos + 1
-                neighbor_list[neighbor_pos] = [xn, yn, zn, image[xn, yn, zn]]
-                tmp_image[xn, yn, zn] = 1
-
-        # ensure there is enough space to store neighbor_list
-        if neighbor_pos + 100 > neighbor_free:
-            neighbor_free += 10000
-            new_list = np.zeros((10000, 4))
-            neighbor_list = np.vstack((neighbor_list, new_list))
-
-        # the distance between every neighbor point value to new region mean value
-        distance = np.abs(neighbor_list[:neighbor_pos+1, 3] - np.tile(region_mean, neighbor_pos+1))
-
-        # chose the min distance point
-        # voxel_distance = distance.min()
-        index = distance.argmin()
-
-        # mark the new region point with 2 and update new image
-        tmp_image[x, y, z] = 2
-        rg_image[x, y, z] = image[x, y, z]
+            if inside and not visited[xn, yn, zn]:
+                visited[xn, yn, zn] = True
+                value = float(image[xn, yn, zn])
+                if value < region_mean:
+                    heapq.heappush(lower, (-value, (xn, yn, zn)))
+                else:
+                    heapq.heappush(upper, (value, (xn, yn, zn)))
+
+        rg_image[voxel] = image[voxel]
         region_size += 1
-
-        # (x, y, z) the new seed point
-        x = int(neighbor_list[index][0])
-        y = int(neighbor_list[index][1])
-        z = int(neighbor_list[index][2])
+        if region_size >= number:
+            break
+
+        # move the frontier voxels which crossed the new mean to the other heap
+        while upper and upper[0][0] < region_mean:
+            value, item = heapq.heappop(upper)
+            heapq.heappush(lower, (-value, item))
+        while lower and -lower[0][0] > region_mean:
+            value, item = heapq.heappop(lower)
+            heapq.heappush(upper, (-value, item))
+
+        # chose the frontier voxel closest to the mean
+        if not lower and not upper:
+            break
+        if upper and (not lower or (upper[0][0] - region_mean, upper[0][1]) <
+                      (region_mean + lower[0][0], lower[0][1])):
+            value, voxel = heapq.heappop(upper)
+        else:
+            value, voxel = heapq.heappop(lower)
+            value = -value
 
         # update region mean value
-        region_mean = (region_mean*region_size+neighbor_list[index, 3])/(region_size+1)
-
-        # remove the seed point from neighbor_list
-        neighbor_list[index] = neighbor_list[neighbor_pos]
-        neighbor_pos -= 1
+        region_sum += value
+        region_mean = region_sum / (region_size + 1)
 
     return rg_image
 
@@ -127,6 +132,10 @@ class Region(object):
         key is a vertex number, value is a vertex signal with the shape (n_features,)
     neighbors : list
         neighbor regions list
+    signal_sum : numpy array
+        the sum of the vertices' signals
+    signal_sqsum : float
+        the sum of the squared norms of the vertices' signals
     """
 
     def __init__(self):
@@ -140,6 +149,9 @@ class Region(object):
         # Initialize fields
         self.vtx_signal = dict()
         self.neighbors = []
+        # float64, so the sums of integer signals don't overflow
+        self.signal_sum = np.float64(0)
+        self.signal_sqsum = np.float64(0)
 
     # get region's information
     # -------------------------------------------
@@ -235,7 +247,11 @@ class Region(object):
             vertices and their signals
         """
 
-        self.vtx_signal[v_id] = vtx_signal[v_id]
+        signal = vtx_signal[v_id]
+        self.vtx_signal[v_id] = signal
+        signal = np.asarray(signal, dtype=np.float64)
+        self.signal_sum = self.signal_sum + signal
+        self.signal_sqsum += np.sum(np.square(signal))
 
     # output
     # --------------------------------------------
@@ -258,6 +274,9 @@ class EvolvingRegion(Region):
         the seed vertices' numbers
     component : list
         component regions list
+    boundary : BoundaryEdges
+        the edges on the region's boundary, maintained by RegionGrow
+        when the transition level is assessed
     """
 
     def __init__(self, seeds):
@@ -273,6 +292,7 @@ class EvolvingRegion(Region):
         # -----------------
         self.seeds = seeds
         self.component = []
+        self.boundary = None
 
     # get information
     # -------------------------------------------
@@ -295,6 +315,8 @@ class EvolvingRegion(Region):
 
         # merge vertices and signals
         self.vtx_signal.update(region.vtx_signal)
+        self.signal_sum = self.signal_sum + region.signal_sum
+        self.signal_sqsum += region.signal_sqsum
 
         # add region to the component
         self.component.append(region)
@@ -316,6 +338,190 @@ class EvolvingRegion(Region):
             self.neighbors.append(region)
 
 
+class _UnitRegion(Region):
+    """
+    A unit region of VoxelRegions, whose neighbors are looked up on demand.
+    """
+
+    def __init__(self, units, r_id):
+        super(_UnitRegion, self).__init__()
+        self._units = units
+        self._r_id = r_id
+        self._neighbors = None
+
+    @property
+    def neighbors(self):
+        if self._neighbors is None:
+            self._neighbors = [self._units[n] for n in self._units.neighbors[self._r_id]]
+        return self._neighbors
+
+    @neighbors.setter
+    def neighbors(self, regions):
+        # Region.__init__ sets an empty list, which means "not looked up yet" here.
+        self._neighbors = regions if regions else None
+
+
+class VoxelRegions(object):
+    """
+    A sequence of one-voxel unit regions.
+
+    The voxels' signals and neighbors are stored in arrays, and a Region
+    object is created only when the corresponding item is accessed.
+    """
+
+    def __init__(self, voxels, data, neighbors):
+        """
+        Parameters
+        ----------
+        voxels : numpy array
+            Nx3 array, the voxels' coordinates
+        data : numpy array
+            XxYxZxM array
+        neighbors : VertexNeighbors
+            the neighbors of each unit region
+        """
+        self.voxels = voxels
+        self.data = data
+        self.neighbors = neighbors
+        self._regions = dict()
+        # the indices of created regions
+        self.ids = dict()
+
+    def __len__(self):
+        return self.voxels.shape[0]
+
+    def __getitem__(self, r_id):
+        region = self._regions.get(r_id)
+        if region is None:
+            region = _UnitRegion(self, r_id)
+            region.add_vertex(tuple(self.voxels[r_id]), vtx_signal=self.data)
+            self._regions[r_id] = region
+            self.ids[region] = r_id
+        return region
+
+    def __iter__(self):
+        for r_id in range(len(self)):
+            yield self[r_id]
+
+    def tables(self):
+        """Return the sizes, signal sums, neighbors and ids of the unit regions."""
+        n_unit = len(self)
+        unit_sum = self.data[tuple(self.voxels.T)].reshape((n_unit, -1)).astype(np.float64)
+        return np.ones(n_unit, dtype=np.int), unit_sum, self.neighbors, self.ids
+
+
+def volume_neighbors(mask, connectivity=26):
+    """
+    Find the neighbors of each voxel in the mask.
+
+    Parameters
+    ----------
+    mask : numpy bool array
+        XxYxZ array
+    connectivity : integer
+        6, 18 or 26. Two voxels are neighbors if they share a face (6),
+        a face or an edge (18), or a face, an edge or a corner (26).
+
+    Returns
+    -------
+    voxels : numpy array
+        Nx3 array, the coordinates of the mask's voxels in C order
+    neighbors : VertexNeighbors
+        The indices are the voxels' row numbers in the voxels.
+    """
+    voxels = np.transpose(np.nonzero(mask))
+    n_voxel = voxels.shape[0]
+    index_map = -np.ones(mask.shape, dtype=np.int)
+    index_map[mask] = np.arange(n_voxel)
+
+    rows = []
+    cols = []
+    for offset in _neighbor_offsets(connectivity):
+        # pair each voxel with the voxel shifted by the offset
+        src = tuple(slice(max(0, -d), n - max(0, d)) for d, n in zip(offset, mask.shape))
+        dst = tuple(slice(max(0, d), n - max(0, -d)) for d, n in zip(offset, mask.shape))
+        src_ids = index_map[src]
+        dst_ids = index_map[dst]
+        valid = np.logical_and(src_ids >= 0, dst_ids >= 0)
+        rows.append(src_ids[valid])
+        cols.append(dst_ids[valid])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    adjacency = sparse.csr_matrix((np.ones(rows.shape[0], dtype=np.int8), (rows, cols)),
+                                  shape=(n_voxel, n_voxel))
+
+    return voxels, VertexNeighbors.from_csr(adjacency)
+
+
+class BoundaryEdges(object):
+    """
+    Accumulate the signal distances of the edges which connect an evolving
+    region's unit regions with its outer boundary's unit regions.
+
+    The accumulator is updated as units are merged into the region or
+    leave its outer boundary, visiting only the units' neighbors.
+    The unit neighborhood is assumed to be symmetric.
+    """
+
+    def __init__(self, label, owner, unit_mean, unit_neighbors):
+        """
+        Parameters
+        ----------
+        label : integer
+            the index of the evolving region
+        owner : numpy array
+            owner[r_id] is the index of the evolving region which the unit belongs to
+        unit_mean : numpy array
+            (n_units, n_features) array, the mean signal of each unit region
+        unit_neighbors : list | VertexNeighbors
+            the indices of each unit region's neighbors
+        """
+        self.label = label
+        self.owner = owner
+        self.unit_mean = unit_mean
+        self.unit_neighbors = unit_neighbors
+        self.dist_sum = 0.0
+        self.count = 0
+
+    def _distances(self, r_id, units):
+        return np.sqrt(np.sum(np.square(self.unit_mean[units] - self.unit_mean[r_id]), 1))
+
+    def _update(self, r_id, units, sign):
+        if units.shape[0]:
+            self.dist_sum += sign * np.sum(self._distances(r_id, units))
+            self.count += sign * units.shape[0]
+
+    def _inner_neighbors(self, r_id):
+        units = np.asarray(self.unit_neighbors[r_id], dtype=np.int)
+        return units[self.owner[units] == self.label]
+
+    def add_outer(self, r_id):
+        """Count the edges of a unit which joins the outer boundary."""
+        self._update(r_id, self._inner_neighbors(r_id), 1)
+
+    def remove_outer(self, r_id):
+        """Discount the edges of a unit which leaves the outer boundary."""
+        self._update(r_id, self._inner_neighbors(r_id), -1)
+
+    def add_inner(self, r_id, outer):
+        """
+        Count the edges between a newly merged unit and the outer boundary.
+
+        Parameters
+        ----------
+        r_id : integer
+            the index of the merged unit
+        outer : set
+            the indices of the outer boundary's units
+        """
+        units = [n for n in self.unit_neighbors[r_id] if n in outer]
+        self._update(r_id, np.array(units, dtype=np.int), 1)
+
+    def mean(self):
+        """Return the mean signal distance of the boundary edges."""
+        return self.dist_sum / self.count if self.count else np.nan
+
+
 class RegionGrow(object):
     """
     Region growing performs a segmentation of an object with respect to a set of points.
@@ -346,6 +552,8 @@ class RegionGrow(object):
         self.regions = []
         self.v_id2r_id = None
         self._assess_func = None
+        # (size, signal sum, signal squared sum) of all unit regions
+        self._total_stats = None
 
         self.assess_dict = {
             'transition level': self._assess_transition_level,
@@ -381,6 +589,7 @@ class RegionGrow(object):
 
         n_vtx = surf.vertices_count()
         self.v_id2r_id = -np.ones(n_vtx, dtype=np.int)
+        self._total_stats = None
         if n_parcel:
             # Prepare parcels, neighbors and v_id2r_id
             graph = mesh2graph(surf.faces, n=n_ring,
@@ -395,7 +604,7 @@ class RegionGrow(object):
             if mask is None:
                 for i in range(n_vtx):
                     self.v_id2r_id[i] = i
-                region_neighbors = get_n_ring_neighbor(surf.faces, n_ring)
+                region_neighbors = surf.get_neighbors(n_ring)
             else:
                 mask_id = np.nonzero(mask)[0]
                 vtx_neighbors = get_n_ring_neighbor(surf.faces, n_ring, mask=mask)
@@ -419,7 +628,7 @@ class RegionGrow(object):
             for neighbor_id in region_neighbors[r_id]:
                 region.add_neighbor(self.regions[neighbor_id])
 
-    def vol2regions(self, data, mask=None):
+    def vol2regions(self, data, mask=None, connectivity=26):
         """
         represent the volume to preliminary regions
 
@@ -431,74 +640,22 @@ class RegionGrow(object):
         mask : numpy bool array
             XxYxZ array
             specify a area where the ROI is in.
+        connectivity : integer
+            6, 18 or 26, see volume_neighbors
         """
         assert data.ndim == 4
         if mask is not None:
             assert mask.dtype == bool and data.shape[:3] == mask.shape
         vol_shape = data.shape[:3]
 
-        neighbors = [[1, 0, 0],
-                     [-1, 0, 0],
-                     [0, 1, 0],
-                     [0, -1, 0],
-                     [0, 0, -1],
-                     [0, 0, 1],
-                     [1, 1, 0],
-                     [1, 1, 1],
-                     [1, 1, -1],
-                     [0, 1, 1],
-                     [-1, 1, 1],
-                     [1, 0, 1],
-                     [1, -1, 1],
-                     [-1, -1, 0],
-                     [-1, -1, -1],
-                     [-1, -1, 1],
-                     [0, -1, -1],
-                     [1, -1, -1],
-                     [-1, 0, -1],
-                     [-1, 1, -1],
-                     [0, 1, -1],
-                     [0, -1, 1],
-                     [1, 0, -1],
-                     [1, -1, 0],
-                     [-1, 0, 1],
-                     [-1, 1, 0]]
-
-        self.v_id2r_id = -np.ones(vol_shape, dtype=np.int)
         if mask is None:
             mask = np.any(data, 3)
-        mask_id = [i for i in zip(*np.where(mask))]
-        region_neighbors = []
-        for r_id, v_id in enumerate(mask_id):
-            self.v_id2r_id[v_id] = r_id
-            neighbor_v_ids = []
-            for n in neighbors:
-                n_id = tuple(i+j for i, j in zip(v_id, n))
-
-                # ensure the coordinate is in the vol
-                inside_flag = True
-                for i, pos in enumerate(n_id):
-                    if pos < 0 or pos >= vol_shape[i]:
-                        inside_flag = False
-
-                if inside_flag and mask[n_id]:
-                    neighbor_v_ids.append(n_id)
+        voxels, neighbors = volume_neighbors(mask, connectivity)
 
-            region_neighbors.append(neighbor_v_ids)
-
-        # warning: a region's neighbors is stored as a list rather than a set at here.
-        region_neighbors = [map(lambda x: self.v_id2r_id[x], ids) for ids in region_neighbors]
-
-        # initialize regions
-        n_regions = np.max(self.v_id2r_id) + 1
-        self.regions = [Region() for r_id in range(n_regions)]
-        for r_id, v_id in enumerate(mask_id):
-            self.regions[r_id].add_vertex(v_id, vtx_signal=data)
-
-        # add neighbors
-        for r_id, region in enumerate(self.regions):
-            for neighbor_id in region_neighbors[r_id]:
-                region.add_neighbor(self.regions[neighbor_id])
+        self.v_id2r_id = -np.ones(vol_shape, dtype=np.int)
+        self.v_id2r_id[mask] = np.arange(voxels.shape[0])
+        self.regions = VoxelRegions(voxels, data, neighbors)
+        self._total_stats = None
 
     def arg_parcel(self, seeds_id, stop_criteria, whole_results=False, half_width=0,
                    assess_step=1, metric='euclidean'):
@@ -644,83 +801,198 @@ class RegionGrow(object):
         for evo_r in evolving_regions:
             evo_r.remove_neighbors(merged_regions)
 
-        # ------initialize other variables-------
+        # ------index the unit regions------
+        # The unit regions are addressed by their indices in self.regions,
+        # and their sizes, signal sums and neighbors are stored in arrays.
         n_seed = len(evolving_regions)
+        n_unit = len(self.regions)
+        unit_size, unit_sum, unit_neighbors, unit_ids = self._unit_tables()
+        unit_mean = unit_sum / np.maximum(unit_size, 1)[:, None]
+
+        # owner[r_id] is the index of the evolving region which the unit belongs to
+        owner = -np.ones(n_unit, dtype=np.int)
+        neighbors = []
+        for i, evo_r in enumerate(evolving_regions):
+            owner[[unit_ids[r] for r in evo_r.get_component()]] = i
+            neighbors.append(set(unit_ids[r] for r in evo_r.get_neighbors()))
+
+        # ------initialize other variables-------
         region_size = np.array([region.size() for region in evolving_regions])
+        region_sum = np.array([unit_sum[owner == i].sum(0) for i in range(n_seed)])
         region_assessments = [[] for _ in range(n_seed)]
         r_outer_mean = [[] for _ in range(n_seed)]  # mean value of the region's outer boundary
         r_inner_min = [[] for _ in range(n_seed)]  # minimum value in the region
+        inner_min = [np.min(unit_mean[owner == i]) for i in range(n_seed)]
+        stop_size = np.zeros(n_seed, dtype=np.int) + np.asarray(stop_criteria)
+
+        # The transition level is accumulated on the boundary edges as units are merged.
+        if assess_step and self._assess_func is RegionGrow._assess_transition_level:
+            boundaries = [BoundaryEdges(i, owner, unit_mean, unit_neighbors) for i in range(n_seed)]
+            for i, evo_r in enumerate(evolving_regions):
+                for r_id in neighbors[i]:
+                    boundaries[i].add_outer(r_id)
+                evo_r.boundary = boundaries[i]
+        else:
+            boundaries = None
 
-        # Positive infinity and negative infinity evaluate to True, because they are not equal to zero.
-        dist = np.empty(n_seed)
-        dist.fill(np.inf)
-
-        neighbor = [None] * n_seed
+        def assess(i):
+            evo_r = evolving_regions[i]
+            evo_r.neighbors = [self.regions[r_id] for r_id in neighbors[i]]
+            assessed_value = self._assess_func(evo_r)
+            region_assessments[i].append(assessed_value)
+            r_outer_mean[i].append(np.mean(unit_mean[list(neighbors[i])]))
+            r_inner_min[i].append(inner_min[i])
+            print 'Evolving region{} size: {}'.format(i, evo_r.size())
 
         if assess_step:
-            for i in range(len(evolving_regions)):
+            for i in range(n_seed):
                 if len(evolving_regions[i].get_component()) % assess_step == 0:
-                    assessed_value = self._assess_func(evolving_regions[i])
-                    region_assessments[i].append(assessed_value)
-                    outer_signals = [r.mean_signal() for r in evolving_regions[i].get_neighbors()]
-                    inner_signals = [r.mean_signal() for r in evolving_regions[i].get_component()]
-                    r_outer_mean[i].append(np.mean(outer_signals))
-                    r_inner_min[i].append(np.min(inner_signals))
-                    print 'Evolving region{} size: {}'.format(i, evolving_regions[i].size())
+                    assess(i)
 
         # ------main cycle------
-        while np.any(np.less(region_size, stop_criteria)):
-            r_to_grow = np.less(region_size, stop_criteria)
-            dist[np.logical_not(r_to_grow)] = np.inf
-
-            r_index = np.nonzero(r_to_grow)[0]
+        # The heap holds the nearest neighbor of each growing region as
+        # (distance, region index, version, unit index), so ties are broken
+        # by the smallest region index as np.argmin did. An entry becomes
+        # stale when the region's mean or neighbors change (i.e. its version
+        # is increased), and stale entries are dropped when they are popped.
+        growing = np.less(region_size, stop_size)
+        version = np.zeros(n_seed, dtype=np.int)
+        version_pushed = -np.ones(n_seed, dtype=np.int)
+        heap = []
+
+        def push(i):
+            if neighbors[i]:
+                # sorted, so that ties are broken by the smallest unit index
+                candidates = np.sort(np.fromiter(neighbors[i], dtype=np.int, count=len(neighbors[i])))
+                r_id, r_dist = self._nearest_unit(region_sum[i] / region_size[i],
+                                                  unit_mean, candidates, metric)
+                heapq.heappush(heap, (r_dist, i, version[i], r_id))
+                version_pushed[i] = version[i]
+            else:
+                # If the seed has no neighbor, stop its growing.
+                growing[i] = False
 
-            for i in r_index:
-                # find the nearest neighbor for the each seed region
-                r_neighbor, r_dist, = evolving_regions[i].nearest_neighbor(metric)
-                dist[i] = r_dist
-                neighbor[i] = r_neighbor
+        for i in np.nonzero(growing)[0]:
+            push(i)
 
-            # find the seed which has the nearest neighbor in this iteration
-            r = np.argmin(dist)
-            target_neighbor = neighbor[r]
+        while heap:
+            r_dist, r, r_version, target = heapq.heappop(heap)
+            if not growing[r] or r_version != version[r]:
+                continue
+            r_index = np.nonzero(growing)[0]
 
             # Prevent a seed from intersecting with another seed
-            if target_neighbor not in merged_regions:
-                merged_regions.append(target_neighbor)
+            if owner[target] == -1:
+                owner[target] = r
                 # merge the neighbor to the seed
-                evolving_regions[r].merge(target_neighbor)
-                region_size[r] = region_size[r] + target_neighbor.size()
+                target_neighbor = self.regions[target]
+                evolving_regions[r].vtx_signal.update(target_neighbor.vtx_signal)
+                evolving_regions[r].signal_sum = evolving_regions[r].signal_sum + target_neighbor.signal_sum
+                evolving_regions[r].signal_sqsum += target_neighbor.signal_sqsum
+                evolving_regions[r].component.append(target_neighbor)
+                region_sum[r] += unit_sum[target]
+                region_size[r] += unit_size[target]
+                inner_min[r] = min(inner_min[r], np.min(unit_mean[target]))
+                if boundaries is not None:
+                    boundaries[r].add_inner(target, neighbors[r])
+                for r_id in unit_neighbors[target]:
+                    if owner[r_id] != r and r_id not in neighbors[r]:
+                        neighbors[r].add(r_id)
+                        if boundaries is not None:
+                            boundaries[r].add_outer(r_id)
+                version[r] += 1
+                growing[r] = region_size[r] < stop_size[r]
 
                 if assess_step:
                     # compute assessments
                     if len(evolving_regions[r].get_component()) % assess_step == 0:
-                        assessed_value = self._assess_func(evolving_regions[r])
-                        region_assessments[r].append(assessed_value)
-                        outer_signals = [i.mean_signal() for i in evolving_regions[r].get_neighbors()]
-                        inner_signals = [i.mean_signal() for i in evolving_regions[r].get_component()]
-                        r_outer_mean[r].append(np.mean(outer_signals))
-                        r_inner_min[r].append(np.min(inner_signals))
-                        print 'Evolving region{} size: {}'.format(r, evolving_regions[r].size())
+                        assess(r)
 
             for i in r_index:
                 # remove the neighbor from the neighbor list of growing seeds
-                evolving_regions[i].remove_neighbor(target_neighbor)
+                if target in neighbors[i]:
+                    neighbors[i].discard(target)
+                    version[i] += 1
+                    if boundaries is not None:
+                        boundaries[i].remove_outer(target)
+
+            # find the new nearest neighbors for the changed regions
+            for i in r_index:
+                if growing[i] and version[i] != version_pushed[i]:
+                    push(i)
 
-                # update region_size
-                if not evolving_regions[i].neighbors:
-                    # If the seed has no neighbor, stop its growing.
-                    try:
-                        region_size[i] = stop_criteria[i]
-                    except IndexError:
-                        # It means that the user uses one stop criteria for all evolving regions.
-                        region_size[i] = stop_criteria[0]
+        for i, evo_r in enumerate(evolving_regions):
+            evo_r.neighbors = [self.regions[r_id] for r_id in neighbors[i]]
+            evo_r.boundary = None
 
         return evolving_regions, region_assessments, r_outer_mean, r_inner_min
 
+    @staticmethod
+    def _nearest_unit(mean_signal, unit_mean, candidates, metric='euclidean'):
+        """
+        Find the nearest candidate unit region to a region's mean signal.
+
+        Parameters
+        ----------
+        mean_signal : numpy array
+            the region's mean signal with the shape (n_features,)
+        unit_mean : numpy array
+            the mean signals of all unit regions with the shape (n_units, n_features)
+        candidates : numpy array
+            indices of the candidate unit regions
+        metric : str
+
+        Returns
+        -------
+            the index of the nearest unit region and its distance
+        """
+        neighbor_signals = unit_mean[candidates]
+        self_signal = np.atleast_2d(mean_signal)
+
+        dist = cdist(self_signal, neighbor_signals, metric)[0]
+        if self_signal.shape[1] == 1:
+            # TODO: only suitable for single feature at present
+            R_and_N_signals = neighbor_signals + self_signal
+            normalize_scale = R_and_N_signals - np.min(R_and_N_signals) + 1
+            dist = dist / normalize_scale[:, 0]
+        index = np.argmin(dist)
+
+        return candidates[index], dist[index]
+
     def get_regions(self):
         return self.regions, self.v_id2r_id
 
+    def _unit_tables(self):
+        """
+        Return the sizes, signal sums, neighbors and ids of the unit regions.
+
+        Returns
+        -------
+        unit_size : numpy array
+            the number of each unit region's vertices
+        unit_sum : numpy array
+            (n_units, n_features) array, the sum of each unit region's signals
+        unit_neighbors : list | VertexNeighbors
+            the indices of each unit region's neighbors
+        unit_ids : dict
+            map a unit region to its index
+        """
+        if isinstance(self.regions, VoxelRegions):
+            return self.regions.tables()
+
+        n_unit = len(self.regions)
+        unit_ids = dict((region, r_id) for r_id, region in enumerate(self.regions))
+        unit_size = np.array([region.size() for region in self.regions])
+        n_feature = np.size(self.regions[np.argmax(unit_size)].mean_signal())
+        unit_sum = np.zeros((n_unit, n_feature))
+        for r_id, region in enumerate(self.regions):
+            if unit_size[r_id]:
+                signals = np.reshape(region.vtx_signal.values(), (unit_size[r_id], n_feature))
+                unit_sum[r_id] = np.sum(signals, 0)
+        unit_neighbors = [[unit_ids[n] for n in region.neighbors] for region in self.regions]
+
+        return unit_size, unit_sum, unit_neighbors, unit_ids
+
     def get_seed_region(self):
         """
         used to find a region with max mean feature as seed region.
@@ -731,7 +1003,8 @@ class RegionGrow(object):
             evolving_region : EvolvingRegion
         """
 
-        mean_signal = [np.mean(region.mean_signal()) for region in self.regions]
+        unit_size, unit_sum, _, _ = self._unit_tables()
+        mean_signal = np.mean(unit_sum / np.maximum(unit_size, 1)[:, None], 1)
         seed_r_id = np.argmax(mean_signal)
         seed_v_id = list(zip(*np.where(self.v_id2r_id == seed_r_id)))[0]
         if len(seed_v_id) == 1:
@@ -784,6 +1057,8 @@ class RegionGrow(object):
         assessed_value : float
             Larger assessed_value means better grown region.
         """
+        if getattr(region, 'boundary', None) is not None:
+            return region.boundary.mean()
 
         outer_boundary = region.get_neighbors()
 
@@ -825,6 +1100,42 @@ class RegionGrow(object):
 
         return inv_gray_level_dist
 
+    def _variances(self, region):
+        """
+        Calculate the sum of squared distances between the signals and the
+        mean signal, and the number of vertices, for the region and its
+        complement (all the other unit regions).
+        Both are derived from running sums, so no vertex is visited.
+
+        Parameter
+        ---------
+        region : EvolvingRegion
+
+        Return
+        ------
+        (r_sqdist, r_size), (r_c_sqdist, r_c_size) : tuple
+        """
+        if self._total_stats is None:
+            unit_size, unit_sum, _, _ = self._unit_tables()
+            if isinstance(self.regions, VoxelRegions):
+                sqsum = np.sum(np.square(unit_sum, dtype=np.float64))
+            else:
+                sqsum = sum(r.signal_sqsum for r in self.regions)
+            self._total_stats = (np.sum(unit_size), np.sum(unit_sum, 0), sqsum)
+        total_size, total_sum, total_sqsum = self._total_stats
+
+        stats = []
+        for size, signal_sum, signal_sqsum in (
+                (region.size(), region.signal_sum, region.signal_sqsum),
+                (total_size - region.size(), total_sum - region.signal_sum,
+                 total_sqsum - region.signal_sqsum)):
+            if size:
+                sqdist = max(signal_sqsum - np.sum(np.square(signal_sum, dtype=np.float64)) / float(size), 0)
+            else:
+                sqdist = 0
+            stats.append((sqdist, size))
+        return stats
+
     def _assess_gray_level_dist2(self, region):
         """
         Calculate the within-cluster similarity for the region and its complement.
@@ -840,15 +1151,9 @@ class RegionGrow(object):
         inv_gray_level_dist : float
             Larger assessed_value means better grown region.
         """
-        r_c = EvolvingRegion('region_complement')
-        for r in self.regions:
-            if r not in region.get_component():
-                r_c.merge(r)
-
-        r_mean_signal = np.atleast_2d(region.mean_signal())
-        r_c_mean_signal = np.atleast_2d(r_c.mean_signal())
-        r_variance = np.mean(cdist(region.get_vtx_signal().values(), r_mean_signal))
-        r_c_variance = np.mean(cdist(r_c.get_vtx_signal().values(), r_c_mean_signal))
+        (r_sqdist, r_size), (r_c_sqdist, r_c_size) = self._variances(region)
+        r_variance = r_sqdist / r_size if r_size else 0
+        r_c_variance = r_c_sqdist / r_c_size if r_c_size else 0
 
         gray_level_dist = np.sqrt(r_variance + r_c_variance)
         if gray_level_dist != 0:
@@ -873,15 +1178,7 @@ class RegionGrow(object):
         inv_gray_level_dist : float
             Larger assessed_value means better grown region.
         """
-        r_c = EvolvingRegion('region_complement')
-        for r in self.regions:
-            if r not in region.get_component():
-                r_c.merge(r)
-
-        r_mean_signal = np.atleast_2d(region.mean_signal())
-        r_c_mean_signal = np.atleast_2d(r_c.mean_signal())
-        r_variance = np.sum(cdist(region.get_vtx_signal().values(), r_mean_signal))
-        r_c_variance = np.sum(cdist(r_c.get_vtx_signal().values(), r_c_mean_signal))
+        (r_variance, _), (r_c_variance, _) = self._variances(region)
 
         gray_level_dist = np.sqrt(r_variance + r_c_variance)
         if gray_level_dist != 0:
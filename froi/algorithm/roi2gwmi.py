@@ -6,258 +6,126 @@
 Project the ROI to the gray white matter interface.
 """
 import numpy as np
+from scipy import ndimage as nd
 from froi.algorithm import imtool as imt
-import time as time
-from scipy.spatial import distance as ds
 
-def is_inside(v, shape):
-    """Check whether the coordinate is inside the shaped volume."""
-    return ((v[0] >= 0) & (v[0] < shape[0]) &
-            (v[1] >= 0) & (v[1] < shape[1]) &
-            (v[2] >= 0) & (v[2] < shape[2]))
-    
-def get_neighbors(coor,radius,shape):
-    """Get the neighbor coordinates with in radius cube."""
-    neighbors = []
-    offsets = []
-   
-    for x in np.arange(-radius, radius + 1):
-        for y in np.arange(-radius, radius + 1):
-            for z in np.arange(-radius, radius + 1):
-                offsets.append([x,y,z])
-    
-    offsets = np.array(offsets)
-    #print offsets
-    
-    for offset in offsets:
-        
-        if offset.tolist() == [0,0,0]:
-            #print offset.tolist()
-            continue
-           
-        tmp_neigh = coor + offset
-        #print tmp_neigh
-        inside = is_inside(tmp_neigh,shape)
-        if inside :
-            neighbors.append([tmp_neigh[0],tmp_neigh[1],tmp_neigh[2]])
-    
-    neighbors = np.array(neighbors)
-    #print neighbors.shape
-    return neighbors   
 
-def get_neighbors_surface(coor,radius,shape):
-    """Get the cube surface."""
-    neigh = []
-    if radius <=0:
-        return neigh
-    elif radius ==1:
-        return get_neighbors(coor,radius,shape)
-    else:
-        neighbors_all = get_neighbors(coor,radius,shape)
-        neighbors_in = get_neighbors(coor,radius-1,shape)
-        neigh = [i for i in neighbors_all.tolist() if i not in neighbors_in.tolist()]
+def nearest_feature(feature):
+    """Find the nearest feature voxel of every voxel.
 
-        return neigh
+    A single Euclidean distance transform is computed over the volume.
 
-def roi_to_gwmi(img,brain_wm,nth):
+    Parameters
+    ----------
+    feature : numpy bool array
+        the feature voxels
+
+    Returns
+    -------
+    dist : numpy array
+        the distance (in voxels) from each voxel to its nearest feature voxel
+    indices : numpy array
+        (3,) + feature.shape array, the coordinate of each voxel's nearest
+        feature voxel
+    """
+    return nd.distance_transform_edt(~feature, return_indices=True)
+
+
+def _last_assignment(targets, labels):
+    """Keep the last label assigned to each flat target index."""
+    rev_targets = targets[::-1]
+    targets, last = np.unique(rev_targets, return_index=True)
+    return targets, labels[::-1][last]
+
+
+def roi_to_gwmi(img, brain_wm, max_distance=None):
     """Transform the functional roi to wm.
 
     Algorithm: find the nearest wm voxel.
+    Each ROI voxel is assigned to its nearest voxel on the edge of the
+    white matter labels. Where several ROI voxels share a nearest voxel,
+    the largest ROI id wins.
+
+    Parameters
+    ----------
+    img : numpy array
+        the ROI label volume
+    brain_wm : numpy array
+        the white matter (label) volume
+    max_distance : float | None
+        ROI voxels farther (in voxels) from the interface are discarded.
+        If None, all ROI voxels are projected.
     """
-    #st = time.time()
     data = img
-    wmdata = imt.multi_label_edge_detection(brain_wm)
-    shape = data.shape
-
-    roi_ids = np.unique(data)
-    roi = roi_ids[1:]
-    roi = [int(i) for i in roi]
-    
-    wmdata = wmdata!=0
+    interface = imt.label_edge_detection(brain_wm) != 0
     result_mask = np.zeros(data.shape)
-    #print wmdata   
-    
-    #First, get the nonzero voxel index in image data.
-    #Here image data is a label volume.
-    #ROIs is in it
-    for roi_id in roi:
-        #print roi_id
-        tmp_mask = data==roi_id
-        #print tmp_mask
-        indexs = np.transpose(tmp_mask.nonzero())
-        #print indexs
-        
-        #Second, find the nearest wm voxel for each indexs.
-        for coor in indexs:
-            #print coor
-            x = coor[0]
-            y = coor[1]
-            z = coor[2]
-    
-            if wmdata[x,y,z]==1:
-                result_mask[x,y,z] = roi_id
-            else:
-                #find the nearest neighbor.
-                flag = False
-                radius = 1
-                mindist_voxel = []
-                mindist = 1000     
-                while radius<nth:      
-                    neigh_list = get_neighbors(coor,radius,shape)
-                    radius += 1
-                    #find the nearest white matter voxel.
-                    for n in neigh_list:
-                        #print n
-                        if wmdata[n[0],n[1],n[2]]==1:
-                            flag = True
-                            dist = np.sqrt((n[0]-x)**2+(n[1]-y)**2+(n[2]-z)**2)
-                            # if the distance is smaller than tag, choose it to be nearest.
-                            
-                            if dist < mindist:
-                                mindist = dist
-                                mindist_voxel = n
-                            
-                    if flag:
-                        break
-                #print mindist_voxel
-                if mindist_voxel!=[]:
-                    result_mask[mindist_voxel[0],mindist_voxel[1],mindist_voxel[2]] = roi_id 
-    """
-    for roi_id in roi:
-        tmp_mask = result_mask==roi_id
-        roi_size = tmp_mask.sum()    
-        print roi_id, roi_size
-    """
-    #print "Time use: %s"%(time.time()-st)
+    if not interface.any():
+        return result_mask
+
+    coords = np.nonzero(data)
+    dist, indices = nearest_feature(interface)
+    if max_distance is not None:
+        near = dist[coords] <= max_distance
+        coords = tuple(c[near] for c in coords)
+    labels = data[coords]
+    targets = np.ravel_multi_index(tuple(idx[coords] for idx in indices), data.shape)
+
+    # assign the ROIs in ascending order of their ids
+    order = np.argsort(labels, kind='mergesort')
+    targets, labels = _last_assignment(targets[order], labels[order])
+    result_mask.flat[targets] = labels
     return result_mask
 
-def roi_to_gwmi_1(img,brain_wm):
+
+def roi_to_gwmi_1(img, brain_wm):
     """ Transform the functional roi to wm.
 
     Algorithm: find the nearest wm voxel.
+    The ROI voxels off the interface label their 26-connected neighbors
+    on the interface, and the largest ROI id wins.
     """
-    #st = time.time()
-    neighbors  = [[1,0,0],\
-                 [-1,0,0],\
-                 [0,1,0],\
-                 [0,-1,0],\
-                 [0,0,-1],\
-                 [0,0,1],\
-                 [1,1,0],\
-                 [1,1,1],\
-                 [1,1,-1],\
-                 [0,1,1],\
-                 [-1,1,1],\
-                 [1,0,1],\
-                 [1,-1,1],\
-                 [-1,-1,0],\
-                 [-1,-1,-1],\
-                 [-1,-1,1],\
-                 [0,-1,-1],\
-                 [1,-1,-1],\
-                 [-1,0,-1],\
-                 [-1,1,-1],\
-                 [0,1,-1],\
-                 [0,-1,1],\
-                 [1,0,-1],\
-                 [1,-1,0],\
-                 [-1,0,1],\
-                 [-1,1,0]]
-    neighbors = np.array(neighbors)
-
     data = img
-    wmdata = imt.multi_label_edge_detection(brain_wm)
-    shape = data.shape
-
-    roi_ids = np.unique(data)
-    roi = roi_ids[1:]
-    roi = [int(i) for i in roi]
-    
-    wmdata = wmdata!=0
-    result_mask = np.zeros(shape)
-    #print wmdata   
-    
-    #First, get the nonzero voxel index in image data.
-    #Here image data is a label volume.
-    #ROIs is in it
-    for roi_id in roi:
-        tmp_mask = data==roi_id
-        #print tmp_mask
-        indexs = np.transpose(tmp_mask.nonzero())
-        #print indexs
-        
-        #Second, find the nearest wm voxel for each indexs.
-        #print roi_id,indexs.shape[0]
-        for coor in indexs:
-
-            #x = coor[0]
-            #y = coor[1]
-            # z = coor[2]
-            if wmdata[coor[0],coor[1],coor[2]]==1:
-                pass
-                #result_mask[x,y,z] = roi_id
-            else:
-                #find the nearest neighbor.        
-                neigh_list = [(ioff+coor).tolist() for ioff in neighbors]
-                #find the nearest white matter voxel.
-                for n in neigh_list:
-                    if wmdata[n[0],n[1],n[2]]==1:
-                        result_mask[n[0],n[1],n[2]] = roi_id
-    """
-    for roi_id in roi:
-        tmp_mask = result_mask==roi_id
-        roi_size = tmp_mask.sum()    
-        #print roi_id, roi_size
-    """
-    #print "Time use: %s"%(time.time()-st)
+    interface = imt.label_edge_detection(brain_wm) != 0
+    off_interface = np.where(interface, 0, data)
+    footprint = nd.generate_binary_structure(3, 3)
+    dilated = nd.grey_dilation(off_interface, footprint=footprint, mode='constant', cval=0)
+    result_mask = np.zeros(data.shape)
+    result_mask[interface] = dilated[interface]
     return result_mask
 
 
-def roi_projection(img,roi,dis_th,val_th,mode):
-    """Roi projection."""
-    #st = time.time()
+def roi_projection(img, roi, dis_th, val_th, mode):
+    """Roi projection.
+
+    Each nonzero voxel of img is projected onto its nearest voxel on the
+    edge of roi, if the distance is smaller than dis_th.
+    mode 0 marks the projected voxels, mode 1 counts the voxels projected
+    onto each voxel, and mode 2 averages their values. In mode 1 and 2,
+    values below val_th are removed.
+    """
     data = img
-    
-    roi = imt.multi_label_edge_detection(roi)
+    roi = imt.label_edge_detection(roi)
     result_mask = np.zeros(data.shape)
-    con_mask = np.zeros(data.shape)
-    
-    tmp_mask = data > 0 
     roi_mask = roi > 0
+    if not roi_mask.any():
+        return result_mask
+
+    img_coords = np.nonzero(data > 0)
+    dist, indices = nearest_feature(roi_mask)
+    near = dist[img_coords] < dis_th
+    img_coords = tuple(c[near] for c in img_coords)
+    targets = np.ravel_multi_index(tuple(idx[img_coords] for idx in indices), data.shape)
 
-    img_indexs = np.transpose(tmp_mask.nonzero())
-    roi_indexs = np.transpose(roi_mask.nonzero())
-    
-    spacedist = ds.cdist(img_indexs,roi_indexs,'euclidean')
-    #print spacedist
     mode = int(mode)
     val_th = float(val_th)
-    #  print mode,val_th
-    if mode ==0:
-        for dist in spacedist:
-            index = dist.argmin()
-            if dist.min()< dis_th:
-                coor = roi_indexs[index]
-                result_mask[coor[0]][coor[1]][coor[2]] = 1
+    if mode == 0:
+        result_mask.flat[targets] = 1
     elif mode == 1:
-        for dist in spacedist:
-            index = dist.argmin()
-            if dist.min()< dis_th:
-                coor = roi_indexs[index]
-                result_mask[coor[0]][coor[1]][coor[2]] = result_mask[coor[0]][coor[1]][coor[2]]+1
-        result_mask[  result_mask < val_th] = 0 
-    #    print result_mask[result_mask.nonzero()]
-        
+        result_mask.flat[:] = np.bincount(targets, minlength=data.size)
+        result_mask[result_mask < val_th] = 0
     elif mode == 2:
-        for i,dist in enumerate(spacedist):
-            index = dist.argmin()
-            if dist.min()< dis_th:
-                dcoor = img_indexs[i]   # source coor
-                coor = roi_indexs[index]        #target coor
-                result_mask[coor[0]][coor[1]][coor[2]] = result_mask[coor[0]][coor[1]][coor[2]]+data[dcoor[0]][dcoor[1]][dcoor[2]]
-                con_mask[coor[0]][coor[1]][coor[2]] = con_mask[coor[0]][coor[1]][coor[2]]+1
-        result_mask = result_mask/(con_mask+0.0000001)
-        result_mask[  result_mask < val_th] = 0 
-    #    print result_mask[result_mask.nonzero()]
-    # print "Time : %s"%(time.time()-st)
+        count = np.bincount(targets, minlength=data.size)
+        total = np.bincount(targets, data[img_coords], data.size)
+        result_mask.flat[:] = total / np.maximum(count, 1)
+        result_mask[result_mask < val_th] = 0
     return result_mask
@@ -8,17 +8,19 @@ Dataset definition class for FreeROI GUI system.
 import re
 import os
 import sys
+import collections
 
 import nibabel as nib
 import numpy as np
 from nibabel.spatialimages import ImageFileError
+from scipy.spatial import cKDTree
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from froi.algorithm import meshtool as mshtool
 from froi.algorithm import array2qimage as aq
 from ..io.surf_io import read_scalar_data, read_geometry, save2label
-from ..io.io import save2nifti
+from ..io.io import save2nifti, map_nifti_series, map_cached_arrays
 from labelconfig import LabelConfig
 
 
@@ -51,8 +53,84 @@ class DoStack(QObject):
             return False
 
 
+class SliceCache(object):
+    """
+    LRU cache for rendered slices, bounded by a memory budget.
+
+    Each slice is stored with the version of the display settings used to
+    render it, and slices of an older version are regarded as missing.
+    """
+    def __init__(self, budget):
+        """
+        Parameters
+        ----------
+        budget : int
+            The maximal number of bytes of the cached slices. The slice used
+            most recently is always kept, even if it exceeds the budget.
+        """
+        self._budget = budget
+        self._nbytes = 0
+        self._slices = collections.OrderedDict()
+
+    def get(self, index, version):
+        """Return the slice of the version, or None if it isn't cached."""
+        item = self._slices.pop(index, None)
+        if item is None:
+            return None
+        if item[0] != version:
+            self._nbytes -= item[1].nbytes
+            return None
+        # move the slice to the most recently used end
+        self._slices[index] = item
+        return item[1]
+
+    def put(self, index, version, array):
+        """Cache the slice, and evict least recently used slices if needed."""
+        self.pop(index)
+        self._slices[index] = (version, array)
+        self._nbytes += array.nbytes
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used slices until the budget is satisfied."""
+        while self._nbytes > self._budget and len(self._slices) > 1:
+            _, (_, old_array) = self._slices.popitem(last=False)
+            self._nbytes -= old_array.nbytes
+
+    def pop(self, index):
+        """Remove the slice from the cache."""
+        item = self._slices.pop(index, None)
+        if item is not None:
+            self._nbytes -= item[1].nbytes
+
+    def clear(self):
+        self._slices.clear()
+        self._nbytes = 0
+
+    def set_budget(self, budget):
+        self._budget = budget
+        self._evict()
+
+    def get_budget(self):
+        return self._budget
+
+    def nbytes(self):
+        return self._nbytes
+
+
 class VolumeDataset(object):
     """Base dataset in FreeROI GUI system."""
+    # The memory budget (bytes) of rendered axial slices for each volume.
+    rgba_cache_budget = 128 * 1024 ** 2
+    # The directory of uncompressed copies of compressed 4D images, which are
+    # mapped into memory instead of being loaded. Set it to None to disable
+    # the copies, then the volumes are loaded on demand.
+    series_cache_dir = os.path.join(os.path.expanduser('~'), '.freeroi',
+                                    'cache', 'series')
+    # The maximal size (bytes) of the series_cache_dir. The least recently
+    # used copies are removed when it is exceeded.
+    series_cache_size = 8 * 1024 ** 3
+
     def __init__(self, source, label_config_center, name=None, header=None, 
                  view_min=None, view_max=None, alpha=255, colormap='gray',
                  cross_pos=None):
@@ -89,7 +167,8 @@ class VolumeDataset(object):
 
         """
         if isinstance(source, np.ndarray):
-            self._data = np.rot90(source)
+            self._data = source
+            self._series_mapped = False
             if name is None:
                 self._name = 'new_image'
             else:
@@ -109,22 +188,28 @@ class VolumeDataset(object):
             self._name = re.sub(r'(.*)\.nii(\.gz)?', r'\1', basename)
             self.save_mem_load()
 
-        # For convenience, define a shift variable
-        self._y_shift = self.get_data_shape()[1] - 1
+        if self._img and len(self.get_data_shape()) == 4:
+            # avoid reading the whole series from the disk
+            init_data = self._data[..., 0]
+        else:
+            init_data = self._data
 
         if view_min == None:
-            self._view_min = self._data.min()
+            self._view_min = init_data.min()
         else:
             self._view_min = view_min
 
         if view_max == None:
-            self._view_max = self._data.max()
+            self._view_max = init_data.max()
         else:
             self._view_max = view_max
 
         self._alpha = alpha
         self._colormap = colormap
-        self._rgba_list = range(self.get_data_shape()[2])
+        # rendered axial slices are cached lazily, and they are invalidated
+        # by increasing the version when display settings change
+        self._rgba_cache = SliceCache(self.rgba_cache_budget)
+        self._rgba_version = 0
  
         # bool status for the item
         self._visible = True
@@ -150,16 +235,28 @@ class VolumeDataset(object):
             self.update_orth_rgba()
 
     def save_mem_load(self):
-        """Load data around current time-point."""
+        """Load data around current time-point.
+
+        4D data are mapped from the disk with their original dtype, so
+        volumes and time courses are read without loading the whole series.
+        If the data can't be mapped, volumes are loaded on demand.
+        """
+        self._series_mapped = False
         if len(self.get_data_shape())==4 and self._img:
-            data = np.zeros(self.get_data_shape())
-            self._data = np.rot90(data)
-            self._loaded_time_list = [0]
-            self._data[..., 0] = np.rot90(self._img.dataobj[..., 0])
+            data = map_nifti_series(self._img, self.series_cache_dir,
+                                    self.series_cache_size)
+            if data is not None:
+                self._series_mapped = True
+                self._loaded_time_list = []
+                self._data = data
+            else:
+                vol = np.asarray(self._img.dataobj[..., 0])
+                self._data = np.zeros(self.get_data_shape(), dtype=vol.dtype)
+                self._loaded_time_list = [0]
+                self._data[..., 0] = vol
         else:
             self._loaded_time_list = [0]
-            data = self._img.get_data(caching='unchanged')
-            self._data = np.rot90(data)
+            self._data = self._img.get_data(caching='unchanged')
 
     def get_data_shape(self):
         """Get shape of data."""
@@ -171,7 +268,7 @@ class VolumeDataset(object):
             if not isinstance(self._colormap, LabelConfig):
                 colormap = str(self._colormap)
             else:
-                colormap = self._colormap.get_colormap()
+                colormap = self._colormap.get_colormap_lut()
             try:
                 current_roi = self.label_config_center.get_drawing_value()
             except ValueError:
@@ -190,24 +287,24 @@ class VolumeDataset(object):
             self.label_config_center.single_roi_view_update_for_model.emit() 
 
     def update_rgba(self, index=None):
-        """Create a range of qrgba array for display."""
-        # return a rendering factory
-        f = self._rendering_factory()
+        """Invalidate rendered qrgba arrays for display.
 
+        If index is None, all slices are invalidated. Otherwise, only the
+        `index`th slice is. Slices are rendered again when they are asked
+        for by get_rgba.
+        """
         if index == None:
-            if self.is_4d():
-                layer_list = [self._data[..., i, self._time_point] for i in 
-                                    range(self.get_data_shape()[2])]
-            else:
-                layer_list = [self._data[..., i] for i in 
-                                    range(self.get_data_shape()[2])]
-            self._rgba_list = map(f, layer_list)
+            self._rgba_version += 1
         else:
-            if self.is_4d():
-                self._rgba_list[index] = f(self._data[..., index,
-                                                      self._time_point])
-            else:
-                self._rgba_list[index] = f(self._data[..., index])
+            self._rgba_cache.pop(index)
+
+    def _render_rgba(self, index):
+        """Render the qrgba array of the `index`th axial slice."""
+        f = self._rendering_factory()
+        if self.is_4d():
+            return f(np.rot90(self._data[..., index, self._time_point]))
+        else:
+            return f(np.rot90(self._data[..., index]))
 
     def set_cross_pos(self, cross_pos):
         """ Update RGBA data in sagital, axial and coronal directions."""
@@ -238,29 +335,30 @@ class VolumeDataset(object):
         f = self._rendering_factory()
         idx = self._cross_pos[0]
         if self.is_4d():
-            self._sagital_rgba = f(np.rot90(self._data[:, idx, :,
+            self._sagital_rgba = f(np.rot90(self._data[idx, ::-1, :,
                                                        self._time_point]))
         else:
-            self._sagital_rgba = f(np.rot90(self._data[:, idx, :]))
+            self._sagital_rgba = f(np.rot90(self._data[idx, ::-1, :]))
 
     def update_axial_rgba(self):
         """Update the axial disply in orth view."""
         f = self._rendering_factory()
         idx = self._cross_pos[2]
         if self.is_4d():
-            self._axial_rgba = f(self._data[:, :, idx, self._time_point])
+            self._axial_rgba = f(np.rot90(self._data[:, :, idx,
+                                                     self._time_point]))
         else:
-            self._axial_rgba = f(self._data[:, :, idx])
+            self._axial_rgba = f(np.rot90(self._data[:, :, idx]))
 
     def update_coronal_rgba(self):
         """Update the coronal disply in orth view."""
         f = self._rendering_factory()
-        idx = self._y_shift - self._cross_pos[1]
+        idx = self._cross_pos[1]
         if self.is_4d():
-            self._coronal_rgba = f(np.rot90(self._data[idx, :, :,
+            self._coronal_rgba = f(np.rot90(self._data[:, idx, :,
                                                        self._time_point]))
         else:
-            self._coronal_rgba = f(np.rot90(self._data[idx, :, :]))
+            self._coronal_rgba = f(np.rot90(self._data[:, idx, :]))
 
     def set_alpha(self, alpha):
         """Set alpha value."""
@@ -283,10 +381,10 @@ class VolumeDataset(object):
         if self.is_4d():
             if isinstance(tpoint, int):
                 if tpoint >= 0 and tpoint < self.get_data_shape()[3]:
-                    if self._img:
+                    if self._img and not self._series_mapped:
                         if not tpoint in self._loaded_time_list:
                             self._data[..., tpoint] = \
-                                    np.rot90(self._img.dataobj[..., tpoint])
+                                    self._img.dataobj[..., tpoint]
                             self._loaded_time_list.append(tpoint)
                     self._time_point = tpoint
                     self.undo_stack.clear()
@@ -370,25 +468,33 @@ class VolumeDataset(object):
 
     def get_rgba(self, index):
         """Get rgba array based on the index of the layer."""
-        return self._rgba_list[index]
+        rgba = self._rgba_cache.get(index, self._rgba_version)
+        if rgba is None:
+            rgba = self._render_rgba(index)
+            self._rgba_cache.put(index, self._rgba_version, rgba)
+        return rgba
+
+    def set_rgba_cache_budget(self, budget):
+        """Set the memory budget (bytes) of cached rgba slices."""
+        self._rgba_cache.set_budget(budget)
 
     def get_sagital_rgba(self):
         """Return the sagital rgba value.."""
-        if self._sagital_rgba.tolist():
+        if self._sagital_rgba.size:
             return self._sagital_rgba
         else:
             return False
 
     def get_axial_rgba(self):
         """Return the axial rgba value."""
-        if self._axial_rgba.tolist():
+        if self._axial_rgba.size:
             return self._axial_rgba
         else:
             return False
 
     def get_coronal_rgba(self):
         """Return the coronal rgba value.."""
-        if self._coronal_rgba.tolist():
+        if self._coronal_rgba.size:
             return self._coronal_rgba
         else:
             return False
@@ -396,10 +502,8 @@ class VolumeDataset(object):
     def set_voxel(self, x, y, z, value, ignore=True):
         """Set value of the voxel whose coordinate is (x, y, z)."""
         try:
-            if isinstance(y, list):
-                y_trans = [self._y_shift - item for item in y]
             # check coordinate validation
-            coord_list = [(x[i], y_trans[i], z[i]) for i in range(len(x))]
+            coord_list = [(x[i], y[i], z[i]) for i in range(len(x))]
             coord_list = [c for c in coord_list if c[0]>=0 and 
                                         c[0]<self.get_data_shape()[0] and
                                         c[1]>=0 and
@@ -407,12 +511,12 @@ class VolumeDataset(object):
                                         c[2]>=0 and
                                         c[2]<self.get_data_shape()[2]]
             x = [c[0] for c in coord_list]
-            y_trans = [c[1] for c in coord_list]
+            y = [c[1] for c in coord_list]
             z = [c[2] for c in coord_list]
             if self.is_4d():
-                orig_data = self._data[y_trans, x, z, self._time_point]
+                orig_data = self._data[x, y, z, self._time_point]
             else:
-                orig_data = self._data[y_trans, x, z]
+                orig_data = self._data[x, y, z]
             if np.any(orig_data != 0) and not ignore:
                 force = QMessageBox.question(None, "Replace?",
                         "Would you like to replace the original values?",
@@ -421,12 +525,12 @@ class VolumeDataset(object):
                 if force == QMessageBox.No:
                     return
             if self.is_4d():
-                self.undo_stack.push((x, y, z, self._data[y_trans, x, z,
+                self.undo_stack.push((x, y, z, self._data[x, y, z,
                                                           self._time_point]))
-                self._data[y_trans, x, z, self._time_point] = value
+                self._data[x, y, z, self._time_point] = value
             else:
-                self.undo_stack.push((x, y, z, self._data[y_trans, x, z]))
-                self._data[y_trans, x, z] = value
+                self.undo_stack.push((x, y, z, self._data[x, y, z]))
+                self._data[x, y, z] = value
             try:
                 for z_ in range(min(z), max(z)+1):
                     self.update_rgba(z_)
@@ -477,7 +581,7 @@ class VolumeDataset(object):
             data_type[np.complex128] = NIFTI_TYPE_COMPLEX128
             data_type[np.complex256] = NIFTI_TYPE_COMPLEX256
 
-        data = np.rot90(self._data, 3)
+        data = self._data
         if data_type.has_key(data.dtype.type):
             self._header['datatype'] = data_type[data.dtype.type]
         self._header['cal_max'] = data.max()
@@ -530,19 +634,21 @@ class VolumeDataset(object):
         """Get the valoue based on the given x,y,z cordinate."""
         if not time_course:
            if self.is_4d():
-               return self._data[self._y_shift - xyz[1],
-                                 xyz[0], xyz[2], self._time_point]
+               return self._data[xyz[0], xyz[1], xyz[2], self._time_point]
            else:
-               return self._data[self._y_shift - xyz[1], xyz[0], xyz[2]]
+               return self._data[xyz[0], xyz[1], xyz[2]]
         else:
-            if self.is_4d() and self._img:
-               data = self.get_raw_data()
-               data = np.rot90(data)
-               return data[self._y_shift - xyz[1], xyz[0], xyz[2], :]
+            if self.is_4d() and self._img and not self._series_mapped:
+               # read the time course only, then replace loaded time points
+               # which may be modified
+               data = np.array(self._img.dataobj[xyz[0], xyz[1], xyz[2], :])
+               loaded = self._loaded_time_list
+               data[loaded] = self._data[xyz[0], xyz[1], xyz[2], loaded]
+               return data
             elif self.is_4d():
-               return self._data[self._y_shift - xyz[1], xyz[0], xyz[2], :]
+               return self._data[xyz[0], xyz[1], xyz[2], :]
             else:
-               return self._data[self._y_shift - xyz[1], xyz[0], xyz[2]]
+               return self._data[xyz[0], xyz[1], xyz[2]]
 
     def get_lthr_data(self):
         """Return whole data which low-thresholded."""
@@ -555,27 +661,27 @@ class VolumeDataset(object):
         """
         Return the low threshold of the raw data.
         """
-        temp = self._data.copy()
-        temp[temp < self._view_min] = 0
-        return np.rot90(temp, 3)
+        return self.get_lthr_data()
 
     def get_raw_data(self):
-        """Return the raw data."""
-        if self._img and self.is_4d():
+        """Return the raw data.
+
+        The data are not copied, so don't modify them in place.
+        """
+        if self._img and self.is_4d() and not self._series_mapped:
             temp = self._img.get_data(caching='unchanged')
-            temp = np.rot90(temp)
             for tp in self._loaded_time_list:
                 temp[..., tp] = self._data[..., tp]
         else:
             temp = self._data
 
-        return np.rot90(temp, 3)
+        return temp
 
     def get_current_raw_vol(self):
         if self.is_4d():
-            temp = np.rot90(self._data, 3)[..., self._time_point]
+            temp = self._data[..., self._time_point]
         else:
-            temp = np.rot90(self._data, 3)
+            temp = self._data
         return temp
 
     def get_value_label(self, value):
@@ -596,22 +702,18 @@ class VolumeDataset(object):
             data = self._data[..., self._time_point]
         else:
             data = self._data
-        coord = (data==roi).nonzero()
-        #return (data==roi).nonzero()
-        return (coord[1], self._y_shift - coord[0], coord[2])
+        return (data==roi).nonzero()
 
     def get_coord_val(self, x, y, z):
         """Return value based on the given x,y,z cordinate."""
         if self.is_4d():
-            #return self._data[y, x, z, self._time_point]
-            return self._data[self._y_shift - y, x, z, self._time_point]
+            return self._data[x, y, z, self._time_point]
         else:
-            #return self._data[y, x, z]
-            return self._data[self._y_shift - y, x, z]
+            return self._data[x, y, z]
 
     def duplicate(self):
         """Return a duplicated image."""
-        dup_img = VolumeDataset(source=self.get_raw_data(),
+        dup_img = VolumeDataset(source=self.get_raw_data().copy(),
                                 label_config_center=self.get_label_config(),
                                 name=self.get_name()+'_duplicate',
                                 header=self.get_header(),
@@ -643,6 +745,13 @@ class Geometry(object):
         Normalized surface normals for vertices
 
     """
+    # The directory of the geometries' coordinates, faces, normals, 1-ring
+    # neighbors and curvature, which are mapped into memory instead of being
+    # read and computed again. None disables the cache.
+    cache_dir = os.path.join(os.path.expanduser('~'), '.freeroi', 'cache',
+                             'geometry')
+    # The maximal size (bytes) of the cache_dir.
+    cache_size = 1024 ** 3
 
     def __init__(self, geo_path, offset=None):
         """
@@ -657,7 +766,6 @@ class Geometry(object):
             applied. If != 0.0, an additional offset will be used.
 
         """
-        self._coords, self._faces = read_geometry(geo_path)
         geo_dir, self._name = os.path.split(geo_path)
         name_split = self._name.split('.')
         self._suffix = name_split[-1]
@@ -681,13 +789,28 @@ class Geometry(object):
         else:
             raise ImageFileError('This file format-{} is not supported at present.'.format(self._suffix))
 
+        self._curv_path = os.path.join(geo_dir, curv_name)
+        arrays = map_cached_arrays([geo_path, self._curv_path],
+                                   lambda: self._read_arrays(geo_path, self._curv_path),
+                                   self.cache_dir, self.cache_size,
+                                   names=('coords', 'faces', 'nn', 'indptr', 'indices'))
+        self._coords = arrays['coords']
+        # identical faces are stored once and share their topology
+        self._topology = mshtool.get_topology(arrays['faces'])
+        self._topology.add_neighbors(mshtool.VertexNeighbors(arrays['indptr'], arrays['indices']))
+        self._faces = self._topology.faces
+        # the normals are independent of the offset
+        self._nn = arrays['nn']
+        self._curv = arrays.get('curv')
+
         if offset is not None:
             if self._hemi_rl == 'lh':
                 self._coords[:, 0] -= (np.max(self._coords[:, 0]) + offset)
             else:
                 self._coords[:, 0] -= (np.min(self._coords[:, 0]) + offset)
-        self._nn = mshtool.compute_normals(self._coords, self._faces)
-        self._curv_path = os.path.join(geo_dir, curv_name)
+        self._kdtree = None
+        self._geodesic_graph = None
+        self._vertex_areas = None
 
     def get_bin_curv(self):
         """
@@ -699,15 +822,31 @@ class Geometry(object):
         :return:
             binarized curvature
         """
-        if not os.path.exists(self._curv_path):
+        if self._curv is None:
             return None
         if self._suffix in 'gii':
-            bin_curv = nib.load(self._curv_path).darrays[0].data >= 0
+            bin_curv = self._curv >= 0
         else:
-            bin_curv = nib.freesurfer.read_morph_data(self._curv_path) <= 0
+            bin_curv = self._curv <= 0
         bin_curv = bin_curv.astype(np.int)
         return bin_curv
 
+    def _read_arrays(self, geo_path, curv_path):
+        """Read the geometry and the curvature, and compute the normals and 1-ring neighbors."""
+        coords, faces = read_geometry(geo_path)
+        neighbors = mshtool.get_topology(faces).neighbors()
+        arrays = {'coords': coords,
+                  'faces': faces,
+                  'nn': mshtool.compute_normals(coords, faces),
+                  'indptr': neighbors.indptr,
+                  'indices': neighbors.indices}
+        if os.path.exists(curv_path):
+            if self._suffix in 'gii':
+                arrays['curv'] = nib.load(curv_path).darrays[0].data
+            else:
+                arrays['curv'] = nib.freesurfer.read_morph_data(curv_path)
+        return arrays
+
     def save(self, fpath):
         """Save geometry information."""
         nib.freesurfer.write_geometry(fpath, self._coords, self._faces)
@@ -751,7 +890,94 @@ class Geometry(object):
     def apply_xfm(self, mtx):
         """Apply an affine transformation matrix to the x, y, z vectors."""
         self._coords = np.dot(np.c_[self._coords, np.ones(len(self._coords))],
-                             mtx.T)[:, 3]
+                             mtx.T)[:, :3]
+        self._kdtree = None
+        self._geodesic_graph = None
+        self._vertex_areas = None
+
+    def get_kdtree(self):
+        """Return a KD-tree of the vertices, built at the first call."""
+        if self._kdtree is None:
+            self._kdtree = cKDTree(self._coords)
+        return self._kdtree
+
+    @property
+    def topology(self):
+        """The MeshTopology shared by the geometries with identical faces."""
+        return self._topology
+
+    def get_neighbors(self, n=1):
+        """Return the n-ring neighbors of each vertex, which are cached for each n."""
+        return self.topology.neighbors(n)
+
+    def get_vtx_neighbor(self, vtx, n=1, ordinal=False, mask=None):
+        """Return one vertex's n-ring neighbors as a set."""
+        return self.topology.vertex_n_ring(vtx, n, ordinal, mask)
+
+    def get_geodesic_graph(self):
+        """Return the edge-length-weighted graph of the mesh, built at the first call."""
+        if self._geodesic_graph is None:
+            self._geodesic_graph = mshtool.mesh_edge_lengths(self._coords, self._faces,
+                                                             self._topology.edges())
+        return self._geodesic_graph
+
+    def get_vertex_areas(self):
+        """Return the area of each vertex, computed at the first call."""
+        if self._vertex_areas is None:
+            self._vertex_areas = mshtool.vertex_areas(self._coords, self._faces)
+        return self._vertex_areas
+
+    def geodesic_distance(self, sources, max_distance=np.inf):
+        """Return the geodesic distance from the nearest source to each vertex."""
+        return mshtool.geodesic_distance(self.get_geodesic_graph(), sources, max_distance)
+
+    def geodesic_disc(self, centers, radius):
+        """Return the vertices within the geodesic radius of any center."""
+        return mshtool.geodesic_disc(self.get_geodesic_graph(), centers, radius)
+
+    def nearest_vertices(self, points, k=1, max_distance=np.inf):
+        """
+        Find the k nearest vertices of each point.
+
+        Parameters
+        ----------
+        points : array-like
+            Nx3 coordinates
+        k : integer
+            the number of nearest vertices
+        max_distance : float
+            Vertices farther than this distance are not returned.
+
+        Returns
+        -------
+        dist : numpy array
+            the distances, with the shape (N,) if k is 1, otherwise (N, k).
+            The missing neighbors' distances are inf.
+        vertices : numpy array
+            the vertices' indices, with the same shape as dist.
+            The missing neighbors' indices are the number of vertices.
+        """
+        points = np.atleast_2d(points)
+        return self.get_kdtree().query(points, k, distance_upper_bound=max_distance)
+
+    def vertices_in_radius(self, points, radius):
+        """
+        Find the vertices within the radius of each point.
+
+        Parameters
+        ----------
+        points : array-like
+            Nx3 coordinates
+        radius : float
+
+        Return
+        ------
+        vertices : list
+            the sorted vertices' indices of each point
+        """
+        points = np.atleast_2d(points)
+        return [sorted(vertices) for vertices in
+                self.get_kdtree().query_ball_point(points, radius)]
 
 
 class Scalar(object):
@@ -800,6 +1026,8 @@ class Scalar(object):
         self._visible = visible
         self._islabel = islabel
         self._current_map_index = 0
+        # increased when the data are modified
+        self._data_version = 0
 
     @property
     def current_map_index(self):
@@ -818,6 +1046,10 @@ class Scalar(object):
 
     def set_vertices_value(self, vertices, value):
         self._data[vertices, self._current_map_index] = value
+        self._data_version += 1
+
+    def get_data_version(self):
+        return self._data_version
 
     def get_roi_vertices(self, roi):
         return self._data[:, self._current_map_index] == roi
@@ -959,6 +1191,8 @@ class Surface(object):
         self.geometries = dict()
         self._current_geo = None
         self.overlays = list()
+        # cache of the rgba array of each overlay
+        self._overlay_rgba = dict()
         self._visible = True
         self._colormap_geo = 'gray'  # FIXME to make the colormap take effect for geometry
         self.load_geometry(geo_path, offset=offset)
@@ -970,7 +1204,7 @@ class Surface(object):
         if geo.name in self.geometries.keys():
             print 'Invalid Operation! The geometry type is already exist!'
         else:
-            self.geometries[geo.name] = Geometry(geo_path, offset)
+            self.geometries[geo.name] = geo
             self.set_current_geometry(geo.name)
             bin_curv = geo.get_bin_curv()
             if bin_curv is not None:
@@ -1046,24 +1280,52 @@ class Surface(object):
         data = ol.get_current_map()
         colormap = ol.get_colormap()
         if isinstance(colormap, LabelConfig):
-            colormap = colormap.get_colormap()
+            colormap = colormap.get_colormap_lut()
 
         return aq.array2qrgba(data, ol.get_alpha()*255, colormap,
                               (ol.get_vmin(), ol.get_vmax()))  # The scalar_data's alpha is belong to [0, 1].
 
+    def get_cached_rgba(self, ol):
+        """
+        Return the RGBA array of the overlay from the cache.
+
+        The array is recomputed only if the overlay's data, vmin, vmax,
+        colormap, alpha or current map index have been changed.
+
+        :param ol:
+            The element in self.overlays.
+        :return: array
+        """
+        colormap = ol.get_colormap()
+        if isinstance(colormap, LabelConfig):
+            colormap = colormap.get_colormap_lut()
+        key = (ol.get_data_version(), ol.get_vmin(), ol.get_vmax(), colormap,
+               ol.get_alpha(), ol.current_map_index)
+        cached = self._overlay_rgba.get(ol)
+        if cached is None or cached[0] != key:
+            cached = (key, self.get_rgba(ol))
+            self._overlay_rgba[ol] = cached
+        return cached[1]
+
     def get_composite_rgb(self):
 
         start_render_index = self._get_start_render_index()
 
+        # drop the cached arrays of removed overlays
+        for ol in self._overlay_rgba.keys():
+            if ol not in self.overlays:
+                del self._overlay_rgba[ol]
+
         # get rgba arrays according to each overlay
         rgba_list = []
         for ol in self.overlays[start_render_index:]:
             if ol.is_visible():
-                rgba_list.append(self.get_rgba(ol))
+                rgba_list.append(self.get_cached_rgba(ol))
 
         # automatically add the background array
         # The forth column won't be used.
-        background = np.ones((self.vertices_count(), 4)) * 127.5
+        background = np.empty((self.vertices_count(), 4), dtype=np.uint8)
+        background.fill(127)
 
         rgba_list.insert(0, background)
         return aq.qcomposition(rgba_list)
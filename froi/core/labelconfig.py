@@ -6,6 +6,8 @@ import collections
 
 from PyQt4.QtGui import *
 
+from froi.algorithm.array2qimage import LabelLUT
+
 
 class LabelConfig(object):
     """Mainly to config the labels."""
@@ -18,6 +20,7 @@ class LabelConfig(object):
         self.label_index = collections.OrderedDict()
         self.label_color = {}
         self.label_list = []
+        self._colormap_lut = None
         self.load(filepath)
         self._is_global = is_global
 
@@ -40,6 +43,7 @@ class LabelConfig(object):
                                                        int(line[3]),
                                                        int(line[4]))
             f.close()
+            self._colormap_lut = None
 
     def dump(self):
         """Dump the label config info to the disk."""
@@ -74,12 +78,14 @@ class LabelConfig(object):
             raise ValueError, 'Index already exists, choose another one'
         self.label_index[label] = index
         self.label_color[label] = color
+        self._colormap_lut = None
 
     def remove_label(self, label):
         """Remove the given label."""
         if self.has_label(label):
             del self.label_index[label]
             del self.label_color[label]
+            self._colormap_lut = None
 
     def edit_label(self, old_label, label, color):
         """Edit the given label."""
@@ -88,6 +94,7 @@ class LabelConfig(object):
             self.label_color[label] = color
             if old_label != label:
                 del self.label_index[old_label]
+            self._colormap_lut = None
 
     def has_label(self, label):
         """Check if the current label config contains the given label."""
@@ -128,6 +135,7 @@ class LabelConfig(object):
         """Update the color of the given label to the given color."""
         if self.has_label(label):
             self.label_color[label] = color
+            self._colormap_lut = None
 
     def save(self):
         """Save the label config info to the disk."""
@@ -139,6 +147,17 @@ class LabelConfig(object):
         return dict([(self.label_index[label], rgb(self.label_color[label])) for
                      label in self.label_index.keys()])
 
+    def get_colormap_lut(self):
+        """Return the lookup table of the colormap.
+
+        The table is built at the first call, and it is rebuilt only after
+        the labels are changed by add_label, edit_label, update_label_color
+        or remove_label.
+        """
+        if self._colormap_lut is None:
+            self._colormap_lut = LabelLUT(self.get_colormap())
+        return self._colormap_lut
+
     def __str__(self):
         """Override the __str__ method to get all labels."""
         return str(self.label_index.keys())
@@ -1,5 +1,11 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
 import numpy as np
 import nibabel as nib
+from nibabel.openers import ImageOpener
 
 
 def save2nifti(fpath, data, header=None):
@@ -17,6 +23,241 @@ def save2nifti(fpath, data, header=None):
     nib.nifti2.save(img, fpath)
 
 
+def map_nifti_series(img, cache_dir=None, max_size=None):
+    """
+    Map the data of a NIfTI image from the disk instead of loading it.
+
+    Uncompressed and unscaled data are mapped from the image file directly.
+    Otherwise, the data are converted once, volume by volume, into an
+    uncompressed .npy file in the cache_dir, which is mapped at this time
+    and reused as long as the image file's path, size and mtime are same.
+    The original dtype is preserved, except that scaled integer data are
+    stored as float32.
+    When the cache_dir grows over the max_size, the least recently used
+    files are removed.
+    Writing into the returned array never modifies files (copy-on-write).
+
+    Parameters
+    ----------
+    img : Nifti1Image | Nifti2Image
+    cache_dir : string | None
+        The directory of the uncompressed data. If None, compressed or
+        scaled data can't be mapped.
+    max_size : integer | None
+        The maximal size (bytes) of the cache_dir. If None, it is unlimited.
+
+    Return
+    ------
+    data : numpy memmap | None
+        None if the data can't be mapped, such as when the cache_dir
+        can't be written.
+    """
+    proxy = img.dataobj
+    fpath = getattr(proxy, 'file_like', None)
+    if not isinstance(fpath, basestring) or not os.path.isfile(fpath):
+        return None
+    raw_dtype = img.get_data_dtype()
+    scaled = not (proxy.slope == 1 and proxy.inter == 0)
+    compressed = fpath.endswith(('.gz', '.bz2'))
+
+    if not scaled and not compressed:
+        return np.memmap(fpath, dtype=raw_dtype, mode='c', offset=proxy.offset,
+                         shape=proxy.shape, order='F')
+    if cache_dir is None:
+        return None
+
+    stat = os.stat(fpath)
+    key = '{}|{}|{}'.format(os.path.abspath(fpath), stat.st_size, stat.st_mtime)
+    cache_path = os.path.join(cache_dir, hashlib.md5(key).hexdigest() + '.npy')
+    try:
+        if not os.path.exists(cache_path):
+            _write_series_cache(fpath, proxy, raw_dtype, scaled, cache_path)
+            if max_size is not None:
+                _evict_cache(cache_dir, max_size, cache_path)
+        else:
+            # mark it as recently used
+            os.utime(cache_path, None)
+        data = np.load(cache_path, mmap_mode='c')
+    except (IOError, OSError, ValueError):
+        return None
+    return data.reshape(proxy.shape, order='F')
+
+
+def _write_series_cache(fpath, proxy, raw_dtype, scaled, cache_path):
+    """Convert the data of a NIfTI file into an uncompressed .npy file volume by volume."""
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    if not scaled:
+        dtype = raw_dtype.newbyteorder('=')
+    elif raw_dtype == np.float64:
+        dtype = np.float64
+    else:
+        dtype = np.float32
+    shape = proxy.shape
+    vol_shape = shape[:3]
+    n_vol = int(np.prod(shape[3:]))
+    vol_nbytes = int(np.prod(vol_shape)) * raw_dtype.itemsize
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    os.close(fd)
+    try:
+        cache = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype,
+                                          shape=vol_shape + (n_vol,),
+                                          fortran_order=True)
+        with ImageOpener(fpath) as fobj:
+            fobj.seek(proxy.offset)
+            for idx in range(n_vol):
+                vol = np.frombuffer(fobj.read(vol_nbytes), dtype=raw_dtype)
+                vol = vol.reshape(vol_shape, order='F')
+                if scaled:
+                    vol = vol * proxy.slope + proxy.inter
+                cache[..., idx] = vol
+        cache.flush()
+        del cache
+        _rename_cache(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _rename_cache(tmp_path, cache_path):
+    """Move a finished cache into place, unless another process has done it."""
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        if not os.path.exists(cache_path):
+            raise
+
+
+# Increased when the layout of the cached arrays changes, so that the
+# caches written before aren't reused.
+CACHE_FORMAT_VERSION = 1
+
+
+def map_cached_arrays(fpaths, compute, cache_dir=None, max_size=None, names=None):
+    """
+    Map the arrays derived from some files from the disk instead of deriving them.
+
+    The arrays returned by compute are saved once as uncompressed .npy files
+    into a subdirectory of the cache_dir, and they are mapped at later calls
+    as long as the files' paths, sizes and mtimes are same. Writing into the
+    returned arrays never modifies files (copy-on-write).
+    When the cache_dir grows over the max_size, the least recently used
+    subdirectories are removed.
+    The cache is only an acceleration: if it can't be read or written, the
+    arrays are derived by compute.
+
+    Parameters
+    ----------
+    fpaths : list of strings
+        The files which the arrays are derived from. A missing file is a part
+        of the key as well, so the arrays are derived again once it appears.
+    compute : callable
+        It returns a dict whose values are the arrays to be cached.
+    cache_dir : string | None
+        The directory of the cached arrays. If None, the arrays are derived
+        without cache.
+    max_size : integer | None
+        The maximal size (bytes) of the cache_dir. If None, it is unlimited.
+    names : sequence | None
+        The names of the arrays which must be in the cache. A cache missing
+        any of them is derived again.
+
+    Return
+    ------
+    arrays : dict
+        the arrays returned by compute, or the numpy memmaps of them
+    """
+    if cache_dir is None:
+        return compute()
+
+    keys = ['format|{}'.format(CACHE_FORMAT_VERSION)]
+    for fpath in fpaths:
+        fpath = os.path.abspath(fpath)
+        if os.path.exists(fpath):
+            stat = os.stat(fpath)
+            keys.append('{}|{}|{}'.format(fpath, stat.st_size, stat.st_mtime))
+        else:
+            keys.append('{}|missing'.format(fpath))
+    cache_path = os.path.join(cache_dir, hashlib.md5('\n'.join(keys)).hexdigest())
+
+    if os.path.isdir(cache_path):
+        try:
+            arrays = dict((name[:-4], np.load(os.path.join(cache_path, name), mmap_mode='c'))
+                          for name in os.listdir(cache_path) if name.endswith('.npy'))
+            if names is None or all(name in arrays for name in names):
+                # mark it as recently used
+                os.utime(cache_path, None)
+                return arrays
+        except (IOError, OSError, ValueError):
+            pass
+        # a truncated or incomplete cache
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+    arrays = compute()
+    try:
+        _write_cached_arrays(arrays, cache_path)
+        if max_size is not None:
+            _evict_cache(cache_dir, max_size, cache_path)
+    except (IOError, OSError):
+        pass
+    return arrays
+
+
+def _write_cached_arrays(arrays, cache_path):
+    """Save the arrays into the directory cache_path, unless another process has done it."""
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = tempfile.mkdtemp(suffix='.tmp', dir=cache_dir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        _rename_cache(tmp_path, cache_path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def _cache_size(path):
+    """Return the size (bytes) of a cached file or directory."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _evict_cache(cache_dir, max_size, keep):
+    """Remove the least recently used entries, except keep, until the cache_dir fits max_size."""
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.tmp'):
+            continue
+        try:
+            size = _cache_size(path)
+            mtime = os.path.getmtime(path)
+        except OSError:
+            # removed by another process
+            continue
+        total += size
+        if path != keep:
+            entries.append((mtime, size, path))
+
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
 class GiftiReader(object):
 
     def __init__(self, file_path):
@@ -1446,8 +1446,9 @@ class BpMainWindow(QMainWindow):
             new_name = "edge_" + name
 
             # detect the edges
-            new_data = surf_label_edge_detection(data,
-                                                 self.surface_model.data(index.parent(), Qt.UserRole + 6).faces)
+            geometry = self.surface_model.data(index.parent(), Qt.UserRole + 6)
+            new_data = surf_label_edge_detection(data, geometry.faces,
+                                                 neighbors=geometry.get_neighbors())
 
             # save result as a new overlay
             self.surface_model.add_item(index,
@@ -0,0 +1,174 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+"""Benchmarks comparing optimized algorithms with their former implementations.
+
+Usage::
+
+    python -m froi.testing.benchmark
+"""
+
+import timeit
+
+import numpy as np
+
+
+def best_time(func, *args, **kwargs):
+    """Return the best wall time (in seconds) of several calls of func."""
+    repeat = kwargs.pop('repeat', 3)
+    return min(timeit.repeat(lambda: func(*args, **kwargs),
+                             repeat=repeat, number=1))
+
+
+def report(name, old_time, new_time):
+    """Print a line which compares the old time with the new time."""
+    print '{:<48} old: {:9.4f}s  new: {:9.4f}s  speedup: {:8.1f}x'.format(
+        name, old_time, new_time, old_time / max(new_time, 1e-9))
+
+
+# ---------------------array2qrgba-------------------------
+def _legacy_lut_rgba(array, alpha, lut_255):
+    """The former per-element LUT mapping used by array2qrgba."""
+    new_array_shape = array.shape + (4,)
+    new_array = np.zeros(new_array_shape, dtype=np.uint8)
+    if array.ndim == 1:
+        for i in range(array.shape[0]):
+            new_array[i, :] = lut_255[int(array[i])]
+    else:
+        for i in range(array.shape[0]):
+            for j in range(array.shape[1]):
+                new_array[i, j, :] = lut_255[int(array[i, j])]
+    new_array[..., 3] = alpha * array.clip(0, 1)
+    return new_array
+
+
+def bench_array2qrgba(colormap='jet'):
+    """Compare the LUT mapping on a 256x256 slice and a fsaverage surface."""
+    from froi.algorithm import array2qimage as aq
+
+    lut_255 = aq.get_lut(colormap).astype(np.float)
+    for name, shape in (('slice 256x256', (256, 256)),
+                        ('fsaverage overlay 163842', (163842,))):
+        array = np.random.rand(*shape) * 1000
+        normalized = aq._normalize255(array, (0, 1000))
+        old = _legacy_lut_rgba(normalized, 255, lut_255)
+        new = aq.array2qrgba(array, 255, colormap, (0, 1000))
+        assert np.array_equal(old, new)
+        report('array2qrgba({}) {}'.format(colormap, name),
+               best_time(_legacy_lut_rgba, normalized, 255, lut_255),
+               best_time(aq.array2qrgba, array, 255, colormap, (0, 1000)))
+
+
+# ---------------------get_n_ring_neighbor-------------------------
+def grid_faces(n_row, n_col):
+    """Return the faces of a triangulated regular grid of vertices."""
+    idx = np.arange(n_row * n_col).reshape(n_row, n_col)
+    tl = idx[:-1, :-1].ravel()
+    tr = idx[:-1, 1:].ravel()
+    bl = idx[1:, :-1].ravel()
+    br = idx[1:, 1:].ravel()
+    return np.vstack((np.column_stack((tl, tr, bl)),
+                      np.column_stack((tr, br, bl))))
+
+
+def _legacy_n_ring_neighbor(faces, n=1, ordinal=False, mask=None):
+    """
+    The former list-of-sets get_n_ring_neighbor.
+    """
+    from froi.algorithm.meshtool import mesh_edges
+
+    n_vtx = np.max(faces) + 1  # get the number of vertices
+    if mask is not None and np.nonzero(mask)[0].shape[0] == n_vtx:
+        # In this case, the mask covers all vertices and is equal to have no mask (None).
+        # So the program reset it as a None that it will save the computational cost.
+        mask = None
+
+    # find 1_ring neighbors' id for each vertex
+    coo_w = mesh_edges(faces)
+    csr_w = coo_w.tocsr()
+    if mask is None:
+        vtx_iter = range(n_vtx)
+        n_ring_neighbors = [csr_w.indices[csr_w.indptr[i]:csr_w.indptr[i+1]] for i in vtx_iter]
+        n_ring_neighbors = [set(i) for i in n_ring_neighbors]
+    else:
+        mask_id = np.nonzero(mask)[0]
+        vtx_iter = mask_id
+        n_ring_neighbors = [set(csr_w.indices[csr_w.indptr[i]:csr_w.indptr[i+1]])
+                            if mask[i] != 0 else set() for i in range(n_vtx)]
+        for vtx in vtx_iter:
+            neighbor_set = n_ring_neighbors[vtx]
+            neighbor_iter = list(neighbor_set)
+            for i in neighbor_iter:
+                if mask[i] == 0:
+                    neighbor_set.discard(i)
+
+    if n > 1:
+        # find n_ring neighbors
+        one_ring_neighbors = [i.copy() for i in n_ring_neighbors]
+        n_th_ring_neighbors = [i.copy() for i in n_ring_neighbors]
+        # if n>1, go to get more neighbors
+        for i in range(n-1):
+            for neighbor_set in n_th_ring_neighbors:
+                neighbor_set_tmp = neighbor_set.copy()
+                for v_id in neighbor_set_tmp:
+                    neighbor_set.update(one_ring_neighbors[v_id])
+
+            if i == 0:
+                for v_id in vtx_iter:
+                    n_th_ring_neighbors[v_id].remove(v_id)
+
+            for v_id in vtx_iter:
+                n_th_ring_neighbors[v_id] -= n_ring_neighbors[v_id]  # get the (i+2)_th ring neighbors
+                n_ring_neighbors[v_id] |= n_th_ring_neighbors[v_id]  # get the (i+2) ring neighbors
+    elif n == 1:
+        n_th_ring_neighbors = n_ring_neighbors
+    else:
+        raise RuntimeError("The number of rings should be equal or greater than 1!")
+
+    if ordinal:
+        return n_th_ring_neighbors
+    else:
+        return n_ring_neighbors
+
+
+def bench_n_ring_neighbor(n_ring=(1, 2, 3)):
+    """Compare get_n_ring_neighbor on a mesh with about 164k vertices."""
+    from froi.algorithm.meshtool import get_n_ring_neighbor
+
+    faces = grid_faces(405, 405)
+    for n in n_ring:
+        old = _legacy_n_ring_neighbor(faces, n)
+        new = get_n_ring_neighbor(faces, n)
+        assert all(a == set(b) for a, b in zip(old, new))
+        report('get_n_ring_neighbor(n={}) 164k vertices'.format(n),
+               best_time(_legacy_n_ring_neighbor, faces, n, repeat=1),
+               best_time(get_n_ring_neighbor, faces, n))
+
+
+# ---------------------geodesic_path-------------------------
+def bench_geodesic_path(n_hop=(10, 30, 60)):
+    """Compare geodesic_path with bfs on a mesh with about 164k vertices."""
+    from froi.algorithm.tools import bfs
+    from froi.algorithm.meshtool import get_n_ring_neighbor, mesh_edge_lengths, geodesic_path
+
+    n_row = n_col = 405
+    faces = grid_faces(n_row, n_col)
+    rows, cols = np.mgrid[:n_row, :n_col]
+    coords = np.column_stack((cols.ravel(), rows.ravel(), np.zeros(n_row * n_col))).astype(np.float)
+    edge_list = get_n_ring_neighbor(faces)
+    graph = mesh_edge_lengths(coords, faces)
+    start = (n_row // 2) * n_col + n_col // 2
+    for n in n_hop:
+        end = start + n * n_col + n // 2
+        old = bfs(edge_list, start, end)
+        new = geodesic_path(graph, start, end)
+        assert old[0] == new[0] and old[-1] == new[-1]
+        report('geodesic_path vs bfs, {} hops 164k vertices'.format(n),
+               best_time(bfs, edge_list, start, end, repeat=1),
+               best_time(geodesic_path, graph, start, end))
+
+
+if __name__ == '__main__':
+    bench_array2qrgba()
+    bench_n_ring_neighbor()
+    bench_geodesic_path()
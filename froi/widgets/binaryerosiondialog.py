@@ -138,9 +138,9 @@ class SurfBinErosionDialog(BinErosionDialog):
         else:
             bin_data = source_data > self._model.data(self.index, Qt.UserRole)
 
-        new_data = binary_shrink(bin_data,
-                                 faces=self._model.data(self.index.parent(), Qt.UserRole + 6).faces,
-                                 n=n_ring)
+        geometry = self._model.data(self.index.parent(), Qt.UserRole + 6)
+        new_data = binary_shrink(bin_data, geometry.faces,
+                                 n_ring_neighbors=geometry.get_neighbors(n_ring))
         self._model.add_item(self.index,
                              source=new_data.astype(np.int8),
                              colormap="blue",
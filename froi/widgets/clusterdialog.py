@@ -7,7 +7,7 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 from ..algorithm import imtool
 from clusterstatsdialog import ClusterStatsDialog
-from froi.algorithm.meshtool import get_n_ring_neighbor, get_patch_by_crg
+from froi.algorithm.meshtool import surface_cluster_labeling, surface_cluster_stats
 
 
 class ClusterDialog(QDialog):
@@ -148,14 +148,16 @@ class SurfClusterDialog(ClusterDialog):
         vertices_thr = np.where(src_data > threshold)[0]
         mask = np.zeros(geo.coords.shape[0])
         mask[vertices_thr] = 1
-        neighbors = get_n_ring_neighbor(geo.faces, mask=mask)
-        clusters = get_patch_by_crg(set(vertices_thr), neighbors)
-        trg_data = np.zeros(geo.coords.shape[0], dtype=np.uint16)
-        for idx, cluster in enumerate(clusters):
-            trg_data[cluster] = idx + 1
+        labels, _ = surface_cluster_labeling(geo.faces, mask, geo.get_neighbors())
+        trg_data = labels.astype(np.uint16)
         self._model.add_item(self._index,
                              source=trg_data,
                              name=out_name,
                              islabel=True,
                              colormap='rainbow')
+        cluster_info = surface_cluster_stats(labels, src_data, geo.coords, geo.faces,
+                                             geo.get_vertex_areas())
+        stats_dialog = ClusterStatsDialog(cluster_info, labels=['index', 'max value', 'X', 'Y', 'Z',
+                                                                'size', 'area', 'vertex'])
+        stats_dialog.exec_()
         self.done(0)
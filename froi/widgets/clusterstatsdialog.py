@@ -9,9 +9,13 @@ from ..interface import csv
 
 class ClusterStatsDialog(QDialog):
     """A dialog for reporting cluster stats."""
-    def __init__(self, cluster_info, parent=None):
+    def __init__(self, cluster_info, parent=None, labels=None):
         super(ClusterStatsDialog, self).__init__(parent)
         self._cluster_info = cluster_info
+        if labels is None:
+            labels = ['index', 'max value', 'X', 'Y', 'Z', 'size',
+                      'mean value', 'center X', 'center Y', 'center Z']
+        self._labels = labels
 
         self.setWindowModality(Qt.NonModal)
         self.setWindowFlags(Qt.Tool | \
@@ -105,8 +109,7 @@ class ClusterStatsDialog(QDialog):
                                            'output.csv',
                                            'csv files (*.csv *.txt)')
         if path:
-            labels = ['index', 'max value', 'X', 'Y', 'Z', 'size']
-            csv.nparray2csv(self._cluster_info, labels, path)
+            csv.nparray2csv(self._cluster_info, self._labels, path)
             self.done(0)
 
 
@@ -200,7 +200,7 @@ class VolumeListModel(QAbstractListModel):
             else:
                 self._data[row].set_roi_name([value])
         elif role == Qt.UserRole + 5:
-            self._data[row]._data  = np.rot90(value)
+            self._data[row]._data  = value
         elif role == Qt.UserRole + 9:
             if not self._data[row].get_time_point() == value:
                 self._data[row].set_time_point(value)
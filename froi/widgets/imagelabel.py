@@ -5,7 +5,7 @@ import numpy as np
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-from ..algorithm.array2qimage import composition, qrgba2qimage
+from ..algorithm.array2qimage import SliceCompositor, qrgba2qimage
 
 
 """ImageLabel class. It is used to show a slice of the 3D image"""
@@ -30,6 +30,7 @@ class ImageLabel(QLabel):
         self.background = np.zeros((model.getX(), model.getY(), 3), 
                                    dtype=np.uint8)
         self.image = None
+        self.compositor = SliceCompositor()
         self.pm = None
 
         self.voxel_scaler_base = min([self.model.get_voxel_size_x(),
@@ -72,12 +73,9 @@ class ImageLabel(QLabel):
         self.voxels_painter = QPainter()
         self.voxels_painter.begin(self)
         if not self.image or not self.drawing:
-            background = self.background.copy()
-            blend = reduce(composition, 
-                           self.model.rgba_list(self.n_slice), 
-                           background)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.rgba_list(self.n_slice),
+                            self.background)
         pm = QPixmap.fromImage(self.image)
         pm = pm.scaled(pm.size().width() * self.voxel_scaler[1] \
                          * self.model.get_scale_factor('grid'),
@@ -247,6 +245,7 @@ class ImageLabel3d(QLabel):
         self.painter_status = painter_status
         self.background = self.make_background()
         self.image = None
+        self.compositor = SliceCompositor()
         self.pm = None
         self.pic_src_point = None
 
@@ -404,11 +403,8 @@ class SagittalImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getZ(), self.model.getX(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_sagital_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_sagital_rgba_list(), back_temp)
         
         # draw black background
         self.background = self.make_background()
@@ -517,11 +513,8 @@ class SagittalImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getZ(), self.model.getX(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_sagital_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_sagital_rgba_list(), back_temp)
         
         # draw black background
         self.background = self.make_background()
@@ -773,11 +766,8 @@ class AxialImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getX(), self.model.getY(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_axial_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_axial_rgba_list(), back_temp)
 
         # draw black backgroud
         self.background = self.make_background()
@@ -883,11 +873,8 @@ class AxialImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getX(), self.model.getY(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_axial_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_axial_rgba_list(), back_temp)
 
         # draw black backgroud
         self.background = self.make_background()
@@ -1128,11 +1115,8 @@ class CoronalImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getZ(), self.model.getY(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_coronal_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_coronal_rgba_list(), back_temp)
 
         # draw black background
         self.background = self.make_background()
@@ -1236,11 +1220,8 @@ class CoronalImageLabel(ImageLabel3d):
         if not self.image or not self.drawing:
             back_temp = np.zeros((self.model.getZ(), self.model.getY(), 3), 
                                  dtype=np.uint8)
-            blend = reduce(composition, 
-                           self.model.get_coronal_rgba_list(),
-                           back_temp)
-            image = qrgba2qimage(blend)
-            self.image = image
+            self.image = self.compositor.composite_image(
+                            self.model.get_coronal_rgba_list(), back_temp)
 
         # draw black background
         self.background = self.make_background()
@@ -224,8 +224,7 @@ class LabelConfigCenter(QGroupBox, DrawSettings):
             raise ValueError, 'Index already exists, choose another one'
         if self.has_current_label(label):
             raise ValueError, 'Label Name already exists, choose another one'
-        self.get_current_label_config().label_index[label] = index
-        self.get_current_label_config().label_color[label] = color
+        self.get_current_label_config().add_label(label, index, color)
 
     def get_current_label_color(self, label):
         if label:
@@ -237,5 +236,4 @@ class LabelConfigCenter(QGroupBox, DrawSettings):
 
     def remove_current_label(self, label):
         if self.has_current_label(label):
-            del self.get_current_label_config().label_index[label]
-            del self.get_current_label_config().label_color[label]
\ No newline at end of file
+            self.get_current_label_config().remove_label(label)
\ No newline at end of file
@@ -35,11 +35,18 @@ class MeanTSDialog(QDialog):
         self.source_combo.setCurrentIndex(row)
         # self.mask_combo.addItems(QStringList(vol_list))
         self.mask_combo.addItems(vol_list)
+        method_label = QLabel("Method")
+        self.method_combo = QComboBox()
+        self.method_combo.addItems(['mean', 'median', 'pca'])
+        self.corr_check = QCheckBox("Export ROI-to-ROI correlation matrix")
 
         # layout config
         grid_layout = QGridLayout()
         grid_layout.addWidget(mask_label, 0, 0)
         grid_layout.addWidget(self.mask_combo, 0, 1)
+        grid_layout.addWidget(method_label, 1, 0)
+        grid_layout.addWidget(self.method_combo, 1, 1)
+        grid_layout.addWidget(self.corr_check, 2, 0, 1, 2)
 
         # button config
         self.run_button = QPushButton("Export...")
@@ -61,7 +68,7 @@ class MeanTSDialog(QDialog):
 
     def _export(self):
         """
-        Export mean time course.
+        Export the time course of each label in the mask.
 
         """
         source_name = self.source_combo.currentText()
@@ -77,8 +84,18 @@ class MeanTSDialog(QDialog):
                                            Qt.UserRole + 6)
             mask_data = self._model.data(self._model.index(mask_row),
                                          Qt.UserRole + 5)
-            meants = imtool.extract_mean_ts(source_data, mask_data) 
-            meants = meants.tolist()
-            csv.save2csv(meants, path)
+            method = str(self.method_combo.currentText())
+            labels, ts = imtool.extract_roi_ts(source_data, mask_data,
+                                               method=method)
+            labels = [str(label) for label in labels]
+            csv.nparray2csv(ts.T, labels, str(path))
+            if self.corr_check.isChecked():
+                if ts.shape[1] < 2:
+                    QMessageBox.warning(self, "No correlation matrix",
+                                        "At least two time points are needed "
+                                        "to compute the correlation matrix.")
+                else:
+                    corr_path = os.path.splitext(str(path))[0] + '_corr.csv'
+                    csv.nparray2csv(imtool.roi_correlation(ts), labels, corr_path)
             self.done(0)
 
@@ -1,6 +1,7 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+import numpy as np
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
@@ -104,19 +105,12 @@ class RegularROIDialog(QDialog):
             self.out_edit.setFocus()
             return
 
-        if shape == 'Sphere':
-            roi_generater = imtool.sphere_roi
-        elif shape == 'Cube':
-            roi_generater = imtool.cube_roi
-
         center_data = self._model.data(self._model.currentIndex(),
                                        Qt.UserRole + 6)
-        coord_list, value_list = imtool.nonzero_coord(center_data)
-        data = center_data.copy()
-        for idx in range(len(coord_list)):
-            data = roi_generater(data, coord_list[idx][0],
-                                 coord_list[idx][1], coord_list[idx][2],
-                                 radius, value_list[idx])
+        coord_list = np.transpose(np.nonzero(center_data))
+        value_list = center_data[tuple(coord_list.T)]
+        data = imtool.stamp_rois(center_data.copy(), coord_list, radius,
+                                 value_list, shape.lower())
         self._model.addItem(data,
                             None,
                             out,
@@ -100,8 +100,6 @@ class RegularROIFromCSVFileDialog(QDialog):
             self.out_edit.setFocus()
             return
 
-        roi_generater = imtool.sphere_roi
-
         header = self._model.data(self._model.currentIndex(), Qt.UserRole + 11)
         image_affine = self._model.get_affine()
         data = self._model.data(self._model.currentIndex(), Qt.UserRole + 6)
@@ -112,10 +110,7 @@ class RegularROIFromCSVFileDialog(QDialog):
             QMessageBox.critical(self, 'Please check the cordinate in the file.', str(error_info))
             return
 
-        for idx in range(len(coord_list)):
-            new_data = roi_generater(new_data, coord_list[idx][0],
-                                    coord_list[idx][1], coord_list[idx][2],
-                                    radius_list[idx], id_list[idx])
+        new_data = imtool.stamp_rois(new_data, coord_list, radius_list, id_list, 'sphere')
         self._model.addItem(new_data,
                             None,
                             out,
@@ -411,7 +411,7 @@ class SurfaceRGDialog(QtGui.QDialog):
 
             elif depth == 2:
                 scalar_data = self.model.data(self.rg_qmodel_idx, QtCore.Qt.UserRole + 10)
-                neighbors = get_n_ring_neighbor(geometry.faces)
+                neighbors = geometry.get_neighbors()
 
                 self.thresholds = self._threshold_edit.text().split(',')
                 while '' in self.thresholds:
@@ -10,8 +10,8 @@ from mayavi import mlab
 import numpy as np
 
 from froi.widgets.treemodel import TreeModel
-from froi.algorithm.tools import toggle_color, bfs
-from froi.algorithm.meshtool import get_n_ring_neighbor, get_vtx_neighbor
+from froi.algorithm.tools import toggle_color
+from froi.algorithm.meshtool import get_topology, mesh_edge_lengths, geodesic_path
 from froi.algorithm.array2qimage import array2qrgba, _normalize255
 from froi.core.labelconfig import LabelConfig
 
@@ -93,8 +93,11 @@ class SurfaceView(QWidget):
         self.seed_flag = False
         self.scribing_flag = False
         self.edge_list = None
+        self.geodesic_graph = None
+        self.topology = None
         self.point_id = None
         self.old_hemi = None
+        self.old_geometries = None
         self.plot_start = None
         self.path = []
         self.cbar = None
@@ -111,9 +114,13 @@ class SurfaceView(QWidget):
 
         hemis = self.surface_model.get_data()
         visible_hemis = [hemi for hemi in hemis if hemi.is_visible()]
-        if self.old_hemi != visible_hemis:
+        geometries = [hemi.current_geometry() for hemi in visible_hemis]
+        if self.old_hemi != visible_hemis or self.old_geometries != geometries:
+            # the topology is shared, so only the geodesic graph is rebuilt when switching geometry
             self.edge_list = None
+            self.topology = None
             self.old_hemi = visible_hemis
+            self.old_geometries = geometries
 
         # clear the old surface
         if self.surf is not None:
@@ -200,7 +207,7 @@ class SurfaceView(QWidget):
                 data = np.arange(256)
                 colormap = self.top_ol.get_colormap()
                 if isinstance(colormap, LabelConfig):
-                    colormap = colormap.get_colormap()
+                    colormap = colormap.get_colormap_lut()
                 self.lut_opaque = array2qrgba(data, self.top_ol.get_alpha(), colormap)
                 self.lut_opaque[:, 3] = 255
                 self.lut_opaque[0, :3] = np.ones((1, 3)) * 127.5
@@ -252,7 +259,7 @@ class SurfaceView(QWidget):
                     size = self.painter_status.get_drawing_size()
                     vertices = [self.point_id]
                     if size != 0:
-                        vertices.extend(list(get_vtx_neighbor(self.point_id, self.faces, size)))
+                        vertices.extend(self.get_topology().vertex_n_ring(self.point_id, size))
                     self.surface_model.set_vertices_value(value, vertices=vertices)
 
             else:
@@ -316,8 +323,7 @@ class SurfaceView(QWidget):
                 # Make the line's head and tail more easily closed
                 self.point_id = self._origin
 
-            new_path = bfs(self.edge_list, self.plot_start, self.point_id,
-                           deep_limit=50)
+            new_path = geodesic_path(self.geodesic_graph, self.plot_start, self.point_id)
             if new_path:
                 self.plot_start = self.point_id
                 new_path.pop(0)
@@ -327,7 +333,7 @@ class SurfaceView(QWidget):
                     self,
                     'Warning',
                     'There is no line linking the start and end vertices.\n'
-                    'Or the line is too long.\nPlease select the end vertex again.',
+                    'Please select the end vertex again.',
                     QMessageBox.Yes
                 )
 
@@ -348,8 +354,23 @@ class SurfaceView(QWidget):
     def set_painter_status(self, painter_status):
         self.painter_status = painter_status
 
+    def get_topology(self):
+        """Return the topology of the shown faces, built at the first call."""
+        if self.topology is None:
+            if len(self.old_hemi) == 1:
+                # the same faces as the hemisphere's geometry
+                self.topology = self.old_hemi[0].current_geometry().topology
+            else:
+                self.topology = get_topology(self.faces)
+        return self.topology
+
     def create_edge_list(self):
-        self.edge_list = get_n_ring_neighbor(self.faces)
+        self.edge_list = self.get_topology().neighbors()
+        if len(self.old_hemi) == 1:
+            # the geometry's cached graph has the same vertices
+            self.geodesic_graph = self.old_hemi[0].current_geometry().get_geodesic_graph()
+        else:
+            self.geodesic_graph = mesh_edge_lengths(self.coords, self.faces, self.topology.edges())
 
     def get_coords(self):
         return self.coords